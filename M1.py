@@ -1,8 +1,9 @@
-import re, collections, os
+import re, collections, os, zlib, json
+import numpy as np
+import scipy.sparse as sp
 from sklearn.feature_extraction.text import HashingVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from docx import Document
-from PyPDF2 import PdfReader
+from text_extract import read_text, UnsupportedFormat, SUPPORTED_EXTENSIONS
+from ingest import clean_text, ingest_files
 
 # --- PDF & EMAIL ---
 from fpdf import FPDF
@@ -11,15 +12,12 @@ from email.message import EmailMessage
 import getpass
 
 
-# ---------------- CLEANING ----------------
-def clean_text(text):
-    text = re.sub(r'\b(id|roll|reg|registration|date|sl|no)[\s:]*\d+\b', '', text, flags=re.I)
-    return re.sub(r'\s+', ' ', text).strip().lower()
+# ---------------- SUMMARIZATION ----------------
+SUMMARY_CHARS = 3000   # summarize() only looks at the start of a document
 
 
-# ---------------- SUMMARIZATION ----------------
 def summarize(text):
-    sample = text[:3000]
+    sample = text[:SUMMARY_CHARS]
     sents = re.split(r'(?<=[.!?]) +', sample)
     if len(sents) <= 2:
         return sample.capitalize()
@@ -35,82 +33,398 @@ def summarize(text):
 
 
 # ---------------- FILE READING ----------------
-def read_file(filepath):
-    ext = os.path.splitext(filepath)[1].lower()
-
+def read_file(filepath, budget=None):
+    # budget: stop after this many characters (e.g. SUMMARY_CHARS for summaries)
     try:
-        if ext == ".txt":
-            with open(filepath, encoding="utf-8") as f:
-                return f.read()
+        return read_text(filepath, budget)
+    except UnsupportedFormat:
+        return ""
+    except Exception as e:
+        print(f"⚠ Could not read {os.path.basename(filepath)}: {e}")
+        return ""
 
-        elif ext == ".pdf":
-            reader = PdfReader(filepath)
-            return " ".join(page.extract_text() or "" for page in reader.pages)
 
-        elif ext == ".docx":
-            doc = Document(filepath)
-            return " ".join(p.text for p in doc.paragraphs)
+# ---------------- SIMILARITY ----------------
+GROUP_THRESHOLD = 0.75
+SIM_BLOCK_SIZE = 256   # documents compared per block when building the graph
+SIMILARITY_BACKEND = os.environ.get("M1_SIMILARITY_BACKEND", "hashing")   # "hashing" or "minhash"
 
-    except Exception:
-        return ""
 
-    return ""
+def vectorize(cleaned_docs):
+    files = list(cleaned_docs.keys())
+    vectorizer = HashingVectorizer(stop_words='english', n_features=1024)
+    # Rows are L2-normalized, so dot products are cosine similarities
+    vectors = vectorizer.transform(cleaned_docs.values())
+    return files, vectors
 
 
-# ---------------- SIMILARITY ----------------
-def build_similarity(cleaned_docs):
+def similarity_graph(vectors, threshold=GROUP_THRESHOLD, block_size=SIM_BLOCK_SIZE):
+    """
+    Sparse symmetric N×N matrix holding only pairs with cosine >= threshold.
+    Computed block by block so at most N × block_size scores exist at once.
+    """
+    n = vectors.shape[0]
+    rows, cols, vals = [], [], []
+
+    for start in range(0, n, block_size):
+        block = vectors[start:start + block_size].toarray()
+        # Scores of this block against itself and every later document
+        sims = np.asarray(vectors[start:] @ block.T)
+        r, c = np.nonzero(sims >= threshold)
+        keep = r > c  # each unordered pair once, no self-pairs
+        rows.append(start + c[keep])
+        cols.append(start + r[keep])
+        vals.append(sims[r[keep], c[keep]])
+
+    return _edge_graph(rows, cols, vals, n)
+
+
+def _edge_graph(rows, cols, vals, n):
+    i = np.concatenate(rows) if rows else np.array([], dtype=int)
+    j = np.concatenate(cols) if cols else np.array([], dtype=int)
+    v = np.concatenate(vals) if vals else np.array([])
+    graph = sp.coo_matrix((np.concatenate([v, v]), (np.concatenate([i, j]), np.concatenate([j, i]))), shape=(n, n))
+    return graph.tocsr()
+
+
+# ---------------- MINHASH / LSH BACKEND ----------------
+MINHASH_PERMUTATIONS = 128
+SHINGLE_SIZE = 3        # words per shingle
+LSH_TARGET_RECALL = 0.99   # chance that a pair exactly at the threshold becomes a candidate
+LSH_MAX_BUCKET = 64     # larger buckets are linked as a star instead of all pairs
+_MINHASH_PRIME = np.uint64(4294967311)   # smallest prime above 2**32
+
+
+def _minhash_params(num_perm=MINHASH_PERMUTATIONS, seed=1):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, 2**32, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, 2**32, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    words = text.split()
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash_signatures(cleaned_docs, num_perm=MINHASH_PERMUTATIONS):
+    """N × num_perm MinHash signature matrix over word shingles."""
     files = list(cleaned_docs.keys())
-    vectorizer = HashingVectorizer(stop_words='english', n_features=1024)
-    matrix = vectorizer.transform(cleaned_docs.values())
-    sim = cosine_similarity(matrix)
-    return files, sim
+    a, b = _minhash_params(num_perm)
+    sigs = np.full((len(files), num_perm), _MINHASH_PRIME, dtype=np.uint64)
+
+    for row, doc in enumerate(files):
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingles(cleaned_docs[doc])),
+            dtype=np.uint64
+        )
+        if hashes.size:
+            # a·x + b stays below 2**64 because a, x, b < 2**32
+            sigs[row] = ((np.outer(hashes, a) + b) % _MINHASH_PRIME).min(axis=0)
+
+    return files, sigs
+
+
+def _lsh_bands(num_perm, threshold, recall=LSH_TARGET_RECALL):
+    """
+    Pick (bands, rows) with num_perm = bands·rows so that a pair with Jaccard
+    exactly at threshold is a candidate with probability >= recall
+    (1 - (1 - t^rows)^bands), using the most rows per band that still does.
+    """
+    options = [(num_perm // r, r) for r in range(1, num_perm + 1) if num_perm % r == 0]
+    hit = lambda br: 1 - (1 - threshold ** br[1]) ** br[0]
+    enough = [br for br in options if hit(br) >= recall]
+    if not enough:
+        return max(options, key=hit)
+    return max(enough, key=lambda br: br[1])
+
+
+def minhash_graph(sigs, threshold=GROUP_THRESHOLD):
+    """
+    Graph of pairs whose estimated Jaccard >= threshold, for grouping by
+    connected components. Candidate pairs come from banded LSH buckets. A
+    bucket of up to LSH_MAX_BUCKET documents contributes all of its pairs; a
+    larger one (template-heavy batches put hundreds of near-identical files
+    in the same bucket of every band) only links each member to its first
+    member, which is enough to connect them. Cost therefore stays linear in
+    the bucket sizes rather than quadratic.
+    """
+    n, num_perm = sigs.shape
+    bands, rows_per_band = _lsh_bands(num_perm, threshold)
+
+    left, right = [], []
+    for band in range(bands):
+        chunk = np.ascontiguousarray(sigs[:, band * rows_per_band:(band + 1) * rows_per_band])
+        keys = chunk.view(np.dtype((np.void, chunk.dtype.itemsize * rows_per_band))).ravel()
+        _, bucket = np.unique(keys, return_inverse=True)
+        order = np.argsort(bucket, kind="stable")
+        splits = np.flatnonzero(np.diff(bucket[order])) + 1
+        for members in np.split(order, splits):
+            if len(members) > LSH_MAX_BUCKET:
+                left.append(np.full(len(members) - 1, members.min()))
+                right.append(np.delete(members, members.argmin()))
+            elif len(members) > 1:
+                x, y = np.triu_indices(len(members), 1)
+                left.append(members[x])
+                right.append(members[y])
+
+    if not left:
+        return _edge_graph([], [], [], n)
+
+    left, right = np.concatenate(left), np.concatenate(right)
+    pair_ids = np.unique(np.minimum(left, right).astype(np.int64) * n + np.maximum(left, right))
+    pairs = np.stack([pair_ids // n, pair_ids % n], axis=1)
+    scores = (sigs[pairs[:, 0]] == sigs[pairs[:, 1]]).mean(axis=1)
+    keep = scores >= threshold
+    return _edge_graph([pairs[keep, 0]], [pairs[keep, 1]], [scores[keep]], n)
+
+
+def is_minhash(vectors):
+    return isinstance(vectors, np.ndarray)
+
+
+def build_similarity(cleaned_docs, threshold=GROUP_THRESHOLD, backend=None):
+    """
+    Returns (files, graph, vectors). vectors are hashing vectors (cosine) or
+    MinHash signatures (estimated Jaccard) depending on the backend.
+    """
+    backend = backend or SIMILARITY_BACKEND
+    if backend == "minhash":
+        files, sigs = minhash_signatures(cleaned_docs)
+        return files, minhash_graph(sigs, threshold), sigs
+    if backend != "hashing":
+        raise ValueError(f"Unknown similarity backend: {backend}")
+    files, vectors = vectorize(cleaned_docs)
+    return files, similarity_graph(vectors, threshold), vectors
+
+
+def pair_scores(vectors, indices):
+    """Dense similarity scores among a small set of documents (e.g. one group)."""
+    sub = vectors[indices]
+    if is_minhash(vectors):
+        return (sub[:, None, :] == sub[None, :, :]).mean(axis=2)
+    return (sub @ sub.T).toarray()
+
+
+def mean_similarity(vectors):
+    """Mean of the full N×N similarity matrix without building it."""
+    n = vectors.shape[0]
+    if n == 0:
+        return 0.0
+    if is_minhash(vectors):
+        # Each permutation contributes C(count, 2) agreeing pairs per distinct value
+        agreeing = 0
+        for col in vectors.T:
+            counts = np.unique(col, return_counts=True)[1]
+            agreeing += int((counts * (counts - 1)).sum())
+        return (n + agreeing / vectors.shape[1]) / (n * n)
+    # Cosine: |sum of rows|² / N²
+    total = np.asarray(vectors.sum(axis=0)).ravel()
+    return float(total @ total) / (n * n)
 
 
 # ---------------- GROUPING ----------------
-def group_documents(files, sim_matrix, threshold=0.75):
-    groups, used = [], set()
+GROUPING_MODE = os.environ.get("M1_GROUPING_MODE", "components")   # "components", "complete" or "centroid"
+
+
+class DisjointSet:
+    """Union-find over 0..n-1 with path halving and union by size."""
+
+    def __init__(self, n):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+
+def _edges(sim_graph, threshold):
+    """Upper-triangle (i, j) pairs with similarity >= threshold."""
+    coo = sp.triu(sim_graph, k=1).tocoo()
+    keep = coo.data >= threshold
+    return coo.row[keep], coo.col[keep]
+
+
+def connected_components(n, rows, cols):
+    """Components of the edge list as sorted index lists, ordered by smallest member."""
+    ds = DisjointSet(n)
+    for i, j in zip(rows.tolist(), cols.tolist()):
+        ds.union(i, j)
+    members = collections.defaultdict(list)
+    for i in range(n):
+        members[ds.find(i)].append(i)
+    return sorted(members.values(), key=lambda m: m[0])
+
+
+def _complete_linkage(component, neighbours):
+    # Each member joins the first subgroup it is similar to in full, else starts one
+    subgroups = []
+    for i in component:
+        for sub in subgroups:
+            if all(j in neighbours[i] for j in sub):
+                sub.append(i)
+                break
+        else:
+            subgroups.append([i])
+    return subgroups
+
+
+def _centroid_refine(component, vectors, threshold):
+    # Members far from the group's centre (chained in only through others) become singletons
+    if is_minhash(vectors):
+        # Mean estimated Jaccard to the other members, counted per permutation
+        sub = vectors[component]
+        agree = np.zeros(len(component))
+        for col in sub.T:
+            _, inverse, counts = np.unique(col, return_inverse=True, return_counts=True)
+            agree += counts[inverse] - 1
+        closeness = agree / (sub.shape[1] * (len(component) - 1))
+    else:
+        sub = vectors[component]
+        centroid = np.asarray(sub.mean(axis=0)).ravel()
+        norm = np.linalg.norm(centroid)
+        closeness = sub @ (centroid / norm) if norm else np.zeros(len(component))
+    core = [i for i, c in zip(component, closeness) if c >= threshold]
+    if len(core) < 2:
+        return [[i] for i in component]
+    kept = set(core)
+    return [core] + [[i] for i in component if i not in kept]
+
+
+def group_documents(files, sim_graph, threshold=GROUP_THRESHOLD, mode=None, vectors=None):
+    """
+    Group documents into connected components of the similarity graph, so
+    duplicates are grouped transitively (A~B, B~C puts A, B, C together)
+    regardless of input order. mode "complete" splits components until every
+    pair in a group is above the threshold; "centroid" drops members whose
+    similarity to the group centre is below it (requires vectors).
+    """
+    mode = mode or GROUPING_MODE
+    if mode not in ("components", "complete", "centroid"):
+        raise ValueError(f"Unknown grouping mode: {mode}")
+    if mode == "centroid" and vectors is None:
+        raise ValueError("centroid grouping needs the document vectors")
+
+    rows, cols = _edges(sim_graph, threshold)
+    components = connected_components(len(files), rows, cols)
+
+    if mode == "complete":
+        neighbours = collections.defaultdict(set)
+        for i, j in zip(rows.tolist(), cols.tolist()):
+            neighbours[i].add(j)
+            neighbours[j].add(i)
+        components = [sub for c in components for sub in _complete_linkage(c, neighbours)]
+    elif mode == "centroid":
+        components = [sub for c in components
+                      for sub in (_centroid_refine(c, vectors, threshold) if len(c) > 2 else [c])]
+
+    components.sort(key=lambda c: c[0])
+    return [[files[i] for i in c] for c in components]
 
-    for i in range(len(files)):
-        if files[i] in used:
-            continue
 
-        group = [files[i]]
-        used.add(files[i])
+# ---------------- DISCREPANCY DETECTION ----------------
+# Every feature a conflict rule can look at is one bit; documents are scanned
+# once and groups are checked by OR-ing their bitsets
+YEAR_FEATURES = [str(y) for y in range(2000, 2100)]
+RULE_FEATURES = ["mandatory", "must", "optional", "may", "prohibited"]
+FEATURE_NAMES = YEAR_FEATURES + RULE_FEATURES
+_FEATURE_BIT = {name: bit for bit, name in enumerate(FEATURE_NAMES)}
+_FEATURE_WORDS = (len(FEATURE_NAMES) + 63) // 64
+_FEATURE_PATTERN = re.compile(r'\b(?:20\d{2}|' + "|".join(RULE_FEATURES) + r')\b')
 
-        for j in range(len(files)):
-            if i != j and files[j] not in used and sim_matrix[i][j] >= threshold:
-                group.append(files[j])
-                used.add(files[j])
 
-        groups.append(group)
+def _feature_mask(names):
+    mask = np.zeros(_FEATURE_WORDS, dtype=np.uint64)
+    for name in names:
+        bit = _FEATURE_BIT[name]
+        mask[bit >> 6] |= np.uint64(1 << (bit & 63))
+    return mask
 
-    return groups
 
+def _feature_names(bits, mask):
+    present = sum(int(word) << (64 * i) for i, word in enumerate(bits & mask))
+    return [name for name, bit in _FEATURE_BIT.items() if present >> bit & 1]
 
-# ---------------- DISCREPANCY DETECTION ----------------
-def analyze_group(group, cleaned_docs):
-    if len(group) <= 1:
-        return []
 
-    data = {
-        doc: {
-            "years": set(re.findall(r'\b(20\d{2})\b', cleaned_docs[doc])),
-            "rules": set(re.findall(r'\b(mandatory|must|optional|may|prohibited)\b', cleaned_docs[doc]))
-        }
-        for doc in group
-    }
+ALL_FEATURES_MASK = _feature_mask(FEATURE_NAMES)
+YEAR_MASK = _feature_mask(YEAR_FEATURES)
+REQUIRED_MASK = _feature_mask(["mandatory", "must"])
+OPTIONAL_MASK = _feature_mask(["optional"])
+
+
+def extract_features(cleaned_docs, files):
+    """One pass over each document: (len(files), words) uint64 bitsets of FEATURE_NAMES present."""
+    features = np.zeros((len(files), _FEATURE_WORDS), dtype=np.uint64)
+    for row, doc in enumerate(files):
+        bits = 0
+        for match in _FEATURE_PATTERN.finditer(cleaned_docs[doc]):
+            bits |= 1 << _FEATURE_BIT[match.group(0)]
+        for word in range(_FEATURE_WORDS):
+            features[row, word] = (bits >> (64 * word)) & 0xFFFFFFFFFFFFFFFF
+    return features
 
-    issues = []
 
-    years = set().union(*(d["years"] for d in data.values()))
+def _timeline_conflict(bits):
+    years = _feature_names(bits, YEAR_MASK)
     if len(years) > 1:
-        issues.append(f"Timeline conflict detected: {', '.join(sorted(years))}")
+        return f"Timeline conflict detected: {', '.join(years)}"
+
+
+def _policy_contradiction(bits):
+    if (bits & REQUIRED_MASK).any() and (bits & OPTIONAL_MASK).any():
+        return "Policy contradiction: mandatory vs optional statements found"
+
 
-    rules = set().union(*(d["rules"] for d in data.values()))
-    if {"mandatory", "must"} & rules and "optional" in rules:
-        issues.append("Policy contradiction: mandatory vs optional statements found")
+# (flag, rule): each rule takes a group's OR-ed feature bits and returns an issue or None
+CONFLICT_RULES = [
+    ("timeline_conflict", _timeline_conflict),
+    ("policy_contradiction", _policy_contradiction),
+]
 
-    return issues
+
+def document_features(features, row):
+    """Names of the features present in one document's bitset."""
+    return _feature_names(features[row], ALL_FEATURES_MASK)
+
+
+def group_flags(group, cleaned_docs, features=None, index=None):
+    """
+    (flag, message) for each conflict within a group. Pass features from
+    extract_features() (and the file -> row index map) to avoid re-scanning
+    the documents.
+    """
+    if len(group) <= 1:
+        return []
+
+    if features is None:
+        features, index = extract_features(cleaned_docs, group), {doc: i for i, doc in enumerate(group)}
+    bits = np.bitwise_or.reduce(features[[index[doc] for doc in group]], axis=0)
+
+    flags = []
+    for flag, rule in CONFLICT_RULES:
+        issue = rule(bits)
+        if issue:
+            flags.append((flag, issue))
+    return flags
+
+
+def analyze_group(group, cleaned_docs, features=None, index=None):
+    return [issue for _, issue in group_flags(group, cleaned_docs, features, index)]
 
 
 # ---------------- REPORT HELPERS ----------------
@@ -128,78 +442,311 @@ def similarity_label(score):
 
 
 # ---------------- PROFESSIONAL REPORT ----------------
-def generate_report(groups, cleaned_docs, sim_matrix, files):
-    report = []
-
-    report.append("DOCUMENT SIMILARITY ANALYSIS REPORT")
-    report.append("=" * 55)
-    report.append("Objective:")
-    report.append(
-        "To detect duplicate or previously submitted documents and ensure originality "
-        "by analyzing similarity across multiple submissions.\n"
-    )
-
-    report.append("Dataset Overview:")
-    report.append(f"• Total documents analyzed: {len(files)}")
-    report.append("• Supported formats: TXT, PDF, DOCX")
-    report.append("• Vectorization: Hashing Vectorizer")
-    report.append("• Similarity Measure: Cosine Similarity")
-    report.append("• Grouping Threshold: 75%\n")
+# Pairs listed per group; larger groups list their closest pairs plus summary statistics
+MAX_REPORT_PAIRS = int(os.environ.get("M1_REPORT_MAX_PAIRS", "50"))
+
+
+def _score_block(vectors, rows, cols):
+    if is_minhash(vectors):
+        return (vectors[rows][:, None, :] == vectors[cols][None, :, :]).mean(axis=2)
+    return (vectors[rows] @ vectors[cols].T).toarray()
+
+
+def group_pair_scores(vectors, indices, max_pairs=MAX_REPORT_PAIRS):
+    """
+    Pairwise scores within a group, computed in row blocks. Returns (pairs, stats):
+    pairs lists (i, j, score) positions within the group, all of them in order when
+    there are at most max_pairs, otherwise the max_pairs highest scores; stats holds
+    count, min, mean and max over every pair.
+    """
+    k = len(indices)
+    total = k * (k - 1) // 2
+    if total == 0:
+        return [], {"pairs": 0}
+    indices = np.asarray(indices)
+    if max_pairs is None or total <= max_pairs:
+        scores = pair_scores(vectors, indices)
+        iu, ju = np.triu_indices(k, 1)
+        vals = scores[iu, ju]
+        pairs = list(zip(iu.tolist(), ju.tolist(), vals.tolist()))
+        return pairs, {"pairs": total, "min": float(vals.min()), "mean": float(vals.mean()), "max": float(vals.max())}
+
+    block = SIM_BLOCK_SIZE
+    if is_minhash(vectors):
+        block = max(1, min(block, 2**24 // (k * vectors.shape[1])))
+    lo, hi, acc = np.inf, -np.inf, 0.0
+    top_i, top_j, top_v = np.array([], int), np.array([], int), np.array([])
+    for start in range(0, k - 1, block):
+        stop = min(start + block, k - 1)
+        scores = _score_block(vectors, indices[start:stop], indices)
+        bi, bj = np.nonzero(np.triu(np.ones(scores.shape, bool), start + 1))
+        vals = scores[bi, bj]
+        lo, hi, acc = min(lo, vals.min()), max(hi, vals.max()), acc + vals.sum()
+        top_i = np.concatenate([top_i, bi + start])
+        top_j = np.concatenate([top_j, bj])
+        top_v = np.concatenate([top_v, vals])
+        if len(top_v) > max_pairs:
+            keep = np.argpartition(-top_v, max_pairs)[:max_pairs]
+            top_i, top_j, top_v = top_i[keep], top_j[keep], top_v[keep]
+    order = np.lexsort((top_j, top_i, -top_v))
+    pairs = [(int(top_i[o]), int(top_j[o]), float(top_v[o])) for o in order]
+    return pairs, {"pairs": total, "min": float(lo), "mean": float(acc / total), "max": float(hi)}
+
+
+def iter_report_sections(groups, cleaned_docs, files, vectors, history=None, max_pairs=MAX_REPORT_PAIRS):
+    """
+    Yield the report one section at a time as plain dicts (overview, each group
+    followed by one record per member document, summary), so sinks can write it
+    out without holding it all in memory. max_pairs=None lists every pair.
+    history optionally maps a document to its (metadata, score) matches among earlier submissions.
+    """
+    index = {f: i for i, f in enumerate(files)}
+    history = history or {}
+    features = extract_features(cleaned_docs, files)
+
+    def is_duplicate(group):
+        return len(group) > 1 or any(history.get(doc) for doc in group)
+
+    if is_minhash(vectors):
+        vectorization = f"MinHash ({vectors.shape[1]} permutations, {SHINGLE_SIZE}-word shingles)"
+        measure = "Estimated Jaccard Similarity (LSH candidates)"
+    else:
+        vectorization, measure = "Hashing Vectorizer", "Cosine Similarity"
+    yield {"section": "overview", "documents": len(files), "vectorization": vectorization,
+           "measure": measure, "threshold": GROUP_THRESHOLD}
 
+    duplicate_groups = 0
     for idx, group in enumerate(groups, 1):
-        report.append(f"Group {idx}")
-        report.append("-" * 30)
+        duplicate = is_duplicate(group)
+        duplicate_groups += duplicate
+        pairs, stats = group_pair_scores(vectors, [index[doc] for doc in group], max_pairs)
+        flags = group_flags(group, cleaned_docs, features, index)
+        yield {
+            "section": "group",
+            "group": idx,
+            "duplicate": duplicate,
+            "documents": group,
+            "pairs": [(group[i], group[j], score) for i, j, score in pairs],
+            "pair_stats": stats,
+            "history": [(doc, meta["name"], meta["added_at"][:10], score)
+                        for doc in group for meta, score in history.get(doc, [])],
+            "flags": [flag for flag, _ in flags],
+            "issues": [issue for _, issue in flags],
+        }
+        for doc in group:
+            yield {
+                "section": "document",
+                "document": doc,
+                "group": idx,
+                "features": document_features(features, index[doc]),
+                "history": [(meta["name"], meta["added_at"][:10], score) for meta, score in history.get(doc, [])],
+            }
+
+    yield {
+        "section": "summary",
+        "average_similarity": mean_similarity(vectors),
+        "duplicate_groups": duplicate_groups,
+        "history_matches": sum(1 for v in history.values() if v) if history else None,
+        "unique_groups": len(groups) - duplicate_groups,
+    }
+
+
+def render_section(section):
+    """Text lines for one report section."""
+    lines = []
+    kind = section["section"]
 
-        report.append(
+    if kind == "overview":
+        lines.append("DOCUMENT SIMILARITY ANALYSIS REPORT")
+        lines.append("=" * 55)
+        lines.append("Objective:")
+        lines.append(
+            "To detect duplicate or previously submitted documents and ensure originality "
+            "by analyzing similarity across multiple submissions.\n"
+        )
+        lines.append("Dataset Overview:")
+        lines.append(f"• Total documents analyzed: {section['documents']}")
+        lines.append("• Supported formats: TXT, PDF, DOCX")
+        lines.append(f"• Vectorization: {section['vectorization']}")
+        lines.append(f"• Similarity Measure: {section['measure']}")
+        lines.append(f"• Grouping Threshold: {section['threshold']:.0%}\n")
+
+    elif kind == "group":
+        lines.append(f"Group {section['group']}")
+        lines.append("-" * 30)
+        lines.append(
             "Classification: DUPLICATE / ALREADY SUBMITTED"
-            if len(group) > 1 else
+            if section["duplicate"] else
             "Classification: UNIQUE / NEW SUBMISSION"
         )
+        lines.append("Documents:")
+        for doc in section["documents"]:
+            lines.append(f"  - {doc}")
+
+        stats = section["pair_stats"]
+        if stats["pairs"]:
+            lines.append("Similarity Evaluation:")
+            for a, b, score in section["pairs"]:
+                lines.append(f"  {a} ↔ {b} : {score:.2f} ({similarity_label(score)})")
+            omitted = stats["pairs"] - len(section["pairs"])
+            if omitted:
+                lines.append(
+                    f"  … {omitted} more pair(s) not listed "
+                    f"(min {stats['min']:.2f}, mean {stats['mean']:.2f}, max {stats['max']:.2f})"
+                )
+
+        if section["history"]:
+            lines.append("Matches With Earlier Submissions:")
+            for doc, name, date, score in section["history"]:
+                lines.append(f"  {doc} ↔ {name} ({date}) : {score:.2f} ({similarity_label(score)})")
+
+        if section["issues"]:
+            lines.append("Detected Inconsistencies:")
+            for issue in section["issues"]:
+                lines.append(f"  • {issue}")
+
+        lines.append("")
+
+    elif kind == "summary":
+        lines.append("=" * 55)
+        lines.append("Overall Analysis Summary:")
+        lines.append(f"• Average similarity score: {section['average_similarity']:.2f}")
+        lines.append(f"• Duplicate document groups detected: {section['duplicate_groups']}")
+        if section["history_matches"] is not None:
+            lines.append(f"• Documents matching earlier submissions: {section['history_matches']}")
+        lines.append(f"• Unique document submissions: {section['unique_groups']}\n")
+
+        lines.append("Final Conclusion:")
+        lines.append(
+            "The system successfully identifies duplicate and highly similar documents "
+            "across multiple formats, ensuring submission originality and integrity.\n"
+        )
+        lines.append("Decision Support:")
+        lines.append(
+            "• DUPLICATE documents should be rejected or flagged for review.\n"
+            "• UNIQUE documents are eligible for further evaluation or approval."
+        )
 
-        report.append("Documents:")
-        for doc in group:
-            report.append(f"  - {doc}")
-
-        if len(group) > 1:
-            report.append("Similarity Evaluation:")
-            for i in range(len(group)):
-                for j in range(i + 1, len(group)):
-                    f1 = files.index(group[i])
-                    f2 = files.index(group[j])
-                    score = sim_matrix[f1][f2]
-                    report.append(
-                        f"  {group[i]} ↔ {group[j]} : {score:.2f} ({similarity_label(score)})"
-                    )
-
-        issues = analyze_group(group, cleaned_docs)
-        if issues:
-            report.append("Detected Inconsistencies:")
-            for issue in issues:
-                report.append(f"  • {issue}")
-
-        report.append("")
-
-    report.append("=" * 55)
-    report.append("Overall Analysis Summary:")
-    report.append(f"• Average similarity score: {sim_matrix.mean():.2f}")
-
-    duplicate_groups = sum(1 for g in groups if len(g) > 1)
-    report.append(f"• Duplicate document groups detected: {duplicate_groups}")
-    report.append(f"• Unique document submissions: {len(groups) - duplicate_groups}\n")
-
-    report.append("Final Conclusion:")
-    report.append(
-        "The system successfully identifies duplicate and highly similar documents "
-        "across multiple formats, ensuring submission originality and integrity.\n"
-    )
-
-    report.append("Decision Support:")
-    report.append(
-        "• DUPLICATE documents should be rejected or flagged for review.\n"
-        "• UNIQUE documents are eligible for further evaluation or approval."
-    )
-
-    return "\n".join(report)
+    return lines
+
+
+class AnalysisResult:
+    """
+    Structured M1 result: the report sections (overview, groups with pair
+    scores and conflict flags, per-document features, summary). The text
+    report is one rendering of it; to_ndjson() is the machine-readable one.
+    """
+
+    def __init__(self, sections):
+        self.sections = list(sections)
+
+    @classmethod
+    def build(cls, groups, cleaned_docs, files, vectors, history=None, max_pairs=MAX_REPORT_PAIRS):
+        return cls(iter_report_sections(groups, cleaned_docs, files, vectors, history, max_pairs))
+
+    def of(self, kind):
+        return [s for s in self.sections if s["section"] == kind]
+
+    def to_dict(self):
+        return {
+            "overview": self.of("overview")[0],
+            "groups": self.of("group"),
+            "documents": self.of("document"),
+            "summary": self.of("summary")[0],
+        }
+
+    def iter_ndjson(self):
+        for section in self.sections:
+            yield ndjson_line(section)
+
+    def to_ndjson(self):
+        return "".join(self.iter_ndjson())
+
+    def to_text(self):
+        return "\n".join(line for section in self.sections for line in render_section(section))
+
+
+def ndjson_line(section):
+    return json.dumps(section, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def generate_report(groups, cleaned_docs, files, vectors, history=None):
+    """Whole text report as one string (see write_report for streaming to files)."""
+    return AnalysisResult.build(groups, cleaned_docs, files, vectors, history).to_text()
+
+
+# ---------------- REPORT SINKS ----------------
+class TextSink:
+    def __init__(self, f):
+        self.f = f
+        self.first = True
+
+    def write(self, section):
+        for line in render_section(section):
+            if not self.first:
+                self.f.write("\n")
+            self.f.write(line)
+            self.first = False
+
+    def close(self):
+        pass
+
+
+class JsonSink:
+    """Streams sections as the elements of one JSON array."""
+
+    def __init__(self, f):
+        self.f = f
+        self.f.write("[")
+        self.first = True
+
+    def write(self, section):
+        self.f.write(("\n" if self.first else ",\n") + json.dumps(section, ensure_ascii=False))
+        self.first = False
+
+    def close(self):
+        self.f.write("\n]\n")
+
+
+class NdjsonSink:
+    """One compact JSON object per line, for streaming into other pipelines."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, section):
+        self.f.write(ndjson_line(section))
+
+    def close(self):
+        pass
+
+
+class PdfSink:
+    """Renders sections straight into an FPDF document, saved to path on close()."""
+
+    def __init__(self, path):
+        self.path = path
+        self.pdf = FPDF()
+        self.pdf.set_auto_page_break(auto=True, margin=15)
+        self.pdf.add_page()
+        self.pdf.set_font("Arial", size=11)
+
+    def write(self, section):
+        for text in render_section(section):
+            for line in make_pdf_safe(text).split("\n"):
+                self.pdf.multi_cell(0, 6, line)
+
+    def close(self):
+        self.pdf.output(self.path)
+
+
+def write_report(sinks, groups, cleaned_docs, files, vectors, history=None, max_pairs=MAX_REPORT_PAIRS):
+    """Stream every report section to all sinks in a single pass."""
+    for section in iter_report_sections(groups, cleaned_docs, files, vectors, history, max_pairs):
+        for sink in sinks:
+            sink.write(section)
+    for sink in sinks:
+        sink.close()
 
 
 # ---------------- PDF SAFETY ----------------
@@ -238,9 +785,12 @@ def convert_txt_to_pdf(txt_path, pdf_path):
 
 # ---------------- EMAIL ----------------
 def send_email_with_attachment(pdf_path):
-    sender =  "scriptsculptor9@gmail.com"
+    sender = os.environ.get("SMTP_USER", "")
+    password = os.environ.get("SMTP_PASSWORD", "")
+    if not (sender and password):
+        print("⚠ Set SMTP_USER and SMTP_PASSWORD to send the report by email.")
+        return
     receiver = input("Enter receiver email: ").strip()
-    password = "rtma cpxc wdfg xfym"
 
     msg = EmailMessage()
     msg["Subject"] = "Document Similarity Analysis Report"
@@ -272,34 +822,33 @@ def main():
         print("❌ Folder not found.")
         return
 
-    SUPPORTED_FILES = (".txt", ".pdf", ".docx")
-    docs = {}
-
-    for file in os.listdir(folder):
-        if file.lower().endswith(SUPPORTED_FILES):
-            content = read_file(os.path.join(folder, file))
-            if content.strip():
-                docs[file] = content
+    paths = [os.path.join(folder, file) for file in sorted(os.listdir(folder))
+             if file.lower().endswith(SUPPORTED_EXTENSIONS)]
 
-    cleaned_docs = {k: clean_text(v) for k, v in docs.items() if clean_text(v)}
+    # Read + clean in parallel (INGEST_WORKERS processes), in folder order
+    cleaned_docs = {}
+    for path, text, error in ingest_files(paths):
+        if error:
+            print(f"⚠ Could not read {os.path.basename(path)}: {error}")
+        elif text:
+            cleaned_docs[os.path.basename(path)] = text
 
     if len(cleaned_docs) < 2:
         print("❌ Not enough valid documents for comparison.")
         return
 
-    files, sim_matrix = build_similarity(cleaned_docs)
-    groups = group_documents(files, sim_matrix)
-
-    report = generate_report(groups, cleaned_docs, sim_matrix, files)
+    files, sim_graph, vectors = build_similarity(cleaned_docs)
+    groups = group_documents(files, sim_graph, vectors=vectors)
 
-    with open("output_report.txt", "w", encoding="utf-8") as f:
-        f.write(report)
+    # One pass over the analysis feeds the TXT, JSON and PDF reports
+    pdf_file = "output_report.pdf"
+    with open("output_report.txt", "w", encoding="utf-8") as txt, \
+            open("output_report.json", "w", encoding="utf-8") as js:
+        write_report([TextSink(txt), JsonSink(js), PdfSink(pdf_file)], groups, cleaned_docs, files, vectors)
 
     print("✔ Document analysis completed successfully.")
     print("✔ TXT report generated: output_report.txt")
-
-    pdf_file = "output_report.pdf"
-    convert_txt_to_pdf("output_report.txt", pdf_file)
+    print("✔ JSON report generated: output_report.json")
     print("✔ PDF report generated:", pdf_file)
 
     if input("Do you want to send the PDF report via email? (yes/no): ").lower() in ("yes", "y"):
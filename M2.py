@@ -12,9 +12,7 @@ import nltk
 import pytesseract
 from transformers import GPT2Tokenizer, GPT2LMHeadModel
 from spellchecker import SpellChecker
-from PyPDF2 import PdfReader
-from docx import Document
-from pdf2image import convert_from_path
+from pdf2image import pdfinfo_from_path
 from tkinter import Tk
 from tkinter.filedialog import askopenfilename
 import smtplib
@@ -23,6 +21,13 @@ import getpass
 from fpdf import FPDF
 import os
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from ingest import MP_CONTEXT
+from ocr_pool import ocr_page
+from text_extract import read_text, iter_pdf_pages, record_timing
 
 # ----------------------------- NLTK DOWNLOADS -----------------------------
 nltk.download('punkt')
@@ -34,9 +39,21 @@ pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tessera
 # ----------------------------- CONFIGURE POPPLER PATH -----------------------------
 POPPLER_PATH = r"C:\poppler-25.12.0\Library\bin"  # <- adjust as per your installation
 
+# ----------------------------- OCR PIPELINE -----------------------------
+OCR_DPI = 300
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+OCR_ENOUGH_WORDS = int(os.environ.get("OCR_ENOUGH_WORDS", "0"))  # stop OCR after this many words; 0 = all pages
+PAGE_TEXT_MIN_WORDS = 10   # pages with fewer text-layer words are OCR'd
+
 # ----------------------------- PDF FONT PATH -----------------------------
 PDF_FONT_PATH = r"DejaVuSans.ttf"  # optional, fallback to Arial if missing
 
+# ----------------------------- GPT-2 SCORING -----------------------------
+SCORE_WINDOW = 512       # tokens per GPT-2 forward window
+SCORE_STRIDE = 400       # window step; the 112-token overlap is context only
+SCORE_BATCH_SIZE = int(os.environ.get("M2_SCORE_BATCH", "8"))   # windows per forward pass
+SCORE_VOCAB_ROWS = 1024  # token positions projected onto the vocabulary at once
+
 # =========================================================
 # FILE SELECTION FUNCTION
 # =========================================================
@@ -51,47 +68,154 @@ def select_file(filetypes):
 # =========================================================
 # TEXT EXTRACTION FUNCTIONS
 # =========================================================
-def extract_text_from_txt(path):
-    with open(path, "r", encoding="utf-8", errors="ignore") as f:
-        return f.read()
+# Characters handed to the verifier (M2_CHAR_BUDGET, 0 = whole document);
+# extraction stops as soon as the budget is filled
+VERIFY_CHAR_BUDGET = int(os.environ.get("M2_CHAR_BUDGET", "0")) or None
+
+def extract_text_from_txt(path, budget=VERIFY_CHAR_BUDGET):
+    return read_text(path, budget)
 
-def extract_text_from_docx(path):
-    doc = Document(path)
-    return "\n".join(p.text for p in doc.paragraphs)
+def extract_text_from_docx(path, budget=VERIFY_CHAR_BUDGET):
+    return read_text(path, budget)
 
-def extract_text_from_pdf(path):
-    text = ""
+def extract_text_from_pdf(path, budget=VERIFY_CHAR_BUDGET):
     try:
-        reader = PdfReader(path)
-        for page in reader.pages:
-            if page.extract_text():
-                text += page.extract_text() + "\n"
+        return read_text(path, budget).strip()
     except Exception:
-        pass
-    return text.strip()
+        return ""
 
-def extract_text_with_ocr(path):
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+
+def _get_ocr_pool():
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=MP_CONTEXT)
+        return _ocr_pool
+
+def ocr_pages(path, pages, enough_words=0):
+    """
+    Yield (page_no, text, seconds) for the given 1-based pages, in page order.
+    Each worker renders and OCRs a single page, and at most 2 x OCR_WORKERS pages
+    are in flight, so only a bounded window of page images exists at once.
+    Stops early once `enough_words` words have been yielded (0 = never).
+    """
+    pool = _get_ocr_pool()
+    pages = iter(pages)
+    pending = deque()
+
+    def submit_next():
+        page_no = next(pages, None)
+        if page_no is not None:
+            pending.append(pool.submit(ocr_page, path, page_no, OCR_DPI, POPPLER_PATH,
+                                       pytesseract.pytesseract.tesseract_cmd))
+
+    for _ in range(OCR_WORKERS * 2):
+        submit_next()
+
+    words = 0
+    try:
+        while pending:
+            page_no, text, seconds = pending.popleft().result()
+            submit_next()
+            yield page_no, text, seconds
+            words += len(re.findall(r'\w+', text))
+            if enough_words and words >= enough_words:
+                print(f"🧠 OCR stopped early after page {page_no} ({words} words)")
+                break
+    finally:
+        for future in pending:
+            future.cancel()
+
+def extract_text_with_ocr(path, enough_words=OCR_ENOUGH_WORDS):
     print("🧠 OCR activated (scanned or image-based PDF)...")
     if not os.path.exists(POPPLER_PATH):
         print(f"❌ Poppler path not found: {POPPLER_PATH}")
         return ""
     try:
-        images = convert_from_path(path, dpi=300, poppler_path=POPPLER_PATH)
+        page_count = pdfinfo_from_path(path, poppler_path=POPPLER_PATH)["Pages"]
+        text = "".join(t for _, t, _ in ocr_pages(path, range(1, page_count + 1), enough_words))
     except Exception as e:
         print("❌ OCR failed. Check Poppler installation:", e)
         return ""
-    text = ""
-    for img in images:
-        text += pytesseract.image_to_string(img)
     return text.strip()
 
-def extract_pdf_text(path):
-    text = extract_text_from_pdf(path)
-    words = re.findall(r'\w+', text)
-    if len(words) < 50:
-        text = extract_text_with_ocr(path)
-        return text, True
-    return text, False
+def extract_pdf_pages(path, enough_words=OCR_ENOUGH_WORDS, budget=VERIFY_CHAR_BUDGET):
+    """
+    Per-page hybrid extraction: use the embedded text layer where a page has one
+    and OCR only the pages without it. Returns one dict per page, in order, with
+    page, method ("text", "ocr" or "skipped"), words, seconds and text.
+    With a character budget, pages after the one that fills it are neither
+    parsed nor listed, and OCR stops once the extracted text fills it.
+    """
+    pages = []
+    chars = 0
+    try:
+        started = time.perf_counter()
+        for page_no, text in enumerate(iter_pdf_pages(path), 1):
+            pages.append({"page": page_no, "method": "text", "text": text,
+                          "words": len(re.findall(r'\w+', text)),
+                          "seconds": time.perf_counter() - started})
+            chars += len(text)
+            if budget and chars >= budget:
+                print(f"✂ Character budget filled after page {page_no}")
+                break
+            started = time.perf_counter()
+        record_timing("pdf", len(pages), sum(len(p["text"]) for p in pages),
+                      sum(p["seconds"] for p in pages))
+    except Exception as e:
+        print("⚠ PDF text layer unreadable, falling back to OCR for every page:", e)
+        try:
+            page_count = pdfinfo_from_path(path, poppler_path=POPPLER_PATH)["Pages"]
+        except Exception:
+            page_count = 0
+        pages = [{"page": n, "method": "text", "text": "", "words": 0, "seconds": 0.0}
+                 for n in range(1, page_count + 1)]
+
+    need_ocr = [p["page"] for p in pages if p["words"] < PAGE_TEXT_MIN_WORDS]
+    if need_ocr:
+        print(f"🧠 OCR activated for {len(need_ocr)} of {len(pages)} page(s) without a text layer...")
+        for p in pages:
+            if p["page"] in need_ocr:
+                p["method"] = "skipped"
+        if not os.path.exists(POPPLER_PATH):
+            print(f"❌ Poppler path not found: {POPPLER_PATH}")
+        else:
+            text_words = sum(p["words"] for p in pages if p["method"] == "text")
+            word_budget = max(1, enough_words - text_words) if enough_words else 0
+            try:
+                for page_no, text, seconds in ocr_pages(path, need_ocr, word_budget):
+                    p = pages[page_no - 1]
+                    p.update(method="ocr", text=text, words=len(re.findall(r'\w+', text)),
+                             seconds=p["seconds"] + seconds)
+                    chars += len(text)
+                    if budget and chars >= budget:
+                        print(f"✂ Character budget filled; OCR stopped after page {page_no}")
+                        break
+            except Exception as e:
+                print("❌ OCR failed. Check Poppler installation:", e)
+
+    return pages
+
+def print_page_report(pages):
+    for p in pages:
+        print(f"   page {p['page']:>3}: {p['method']:<7} {p['words']:>6} words  {p['seconds']:.2f}s")
+    for method in ("text", "ocr"):
+        chosen = [p for p in pages if p["method"] == method]
+        if chosen:
+            print(f"   {method}: {len(chosen)} page(s), {sum(p['seconds'] for p in chosen):.2f}s")
+
+def extract_pdf_text(path, budget=VERIFY_CHAR_BUDGET):
+    pages = extract_pdf_pages(path, budget=budget)
+    print_page_report(pages)
+    text = "\n".join(p["text"].strip() for p in pages if p["text"].strip())
+    if budget:
+        text = text[:budget]
+    ocr_words = sum(p["words"] for p in pages if p["method"] == "ocr")
+    # Treat the document as OCR text when most of its words came from OCR
+    is_ocr = ocr_words * 2 > sum(p["words"] for p in pages)
+    return text, is_ocr
 
 # =========================================================
 # DOCUMENT AUTHENTICITY VERIFIER
@@ -105,24 +229,81 @@ class DocumentAuthenticityVerifier:
         self.model.eval()
         self.spell = SpellChecker()
 
-    def _statistical_signature(self, text):
-        tokens = self.tokenizer.encode(text)
-        if len(tokens) < 50:
-            return 0.0, 10.0
-        probs, surprises = [], []
-        for i in range(0, len(tokens), 400):
-            chunk = tokens[i:i+512]
-            inputs = torch.tensor([chunk]).to(self.device)
+    def _windows(self, tokens):
+        """Split tokens into (window, n_scored) pairs; only tokens not scored by an earlier window count."""
+        windows, prev_end = [], 0
+        for begin in range(0, len(tokens), SCORE_STRIDE):
+            end = min(begin + SCORE_WINDOW, len(tokens))
+            windows.append((tokens[begin:end], min(end - prev_end, end - begin - 1)))
+            prev_end = end
+            if end == len(tokens):
+                break
+        return windows
+
+    def _score_windows(self, windows):
+        """Mean target-token probability and surprise per window, batched and padded."""
+        results = []
+        pad_id = self.tokenizer.eos_token_id
+        for b in range(0, len(windows), SCORE_BATCH_SIZE):
+            batch = windows[b:b + SCORE_BATCH_SIZE]
+            width = max(len(ids) for ids, _ in batch)
+            input_ids = torch.full((len(batch), width), pad_id, dtype=torch.long)
+            attention = torch.zeros((len(batch), width), dtype=torch.long)
+            scored = torch.zeros((len(batch), width - 1), dtype=torch.bool)
+            for r, (ids, n_scored) in enumerate(batch):
+                input_ids[r, :len(ids)] = torch.tensor(ids)
+                attention[r, :len(ids)] = 1
+                scored[r, len(ids) - 1 - n_scored:len(ids) - 1] = True
+            input_ids = input_ids.to(self.device)
+            attention = attention.to(self.device)
+            scored = scored.to(self.device)
+
             with torch.no_grad():
-                outputs = self.model(inputs, labels=inputs)
-            logits = outputs.logits
-            p = torch.softmax(logits, dim=-1)
-            shift_p = p[..., :-1, :]
-            shift_l = inputs[..., 1:]
-            wp = torch.gather(shift_p, 2, shift_l.unsqueeze(2)).squeeze(2)
-            probs.append(torch.mean(wp).item())
-            surprises.append(-torch.mean(torch.log(wp + 1e-10)).item())
-        return np.mean(probs), np.mean(surprises)
+                hidden = self.model.transformer(input_ids=input_ids, attention_mask=attention).last_hidden_state
+                # Project only scored positions onto the vocabulary, a slice at a time,
+                # and take log-probs as logit - logsumexp instead of a full softmax
+                h = hidden[:, :-1][scored]
+                targets = input_ids[:, 1:][scored]
+                log_p = torch.cat([
+                    self._target_log_probs(h[i:i + SCORE_VOCAB_ROWS], targets[i:i + SCORE_VOCAB_ROWS])
+                    for i in range(0, h.shape[0], SCORE_VOCAB_ROWS)
+                ])
+
+            wp = log_p.exp()
+            row = torch.arange(len(batch), device=self.device).unsqueeze(1).expand_as(scored)[scored]
+            count = torch.zeros(len(batch), device=self.device).index_add_(0, row, torch.ones_like(wp))
+            prob = torch.zeros(len(batch), device=self.device).index_add_(0, row, wp) / count
+            surprise = torch.zeros(len(batch), device=self.device).index_add_(0, row, -torch.log(wp + 1e-10)) / count
+            results.extend(zip(prob.tolist(), surprise.tolist()))
+        return results
+
+    def _target_log_probs(self, hidden, targets):
+        logits = self.model.lm_head(hidden).float()
+        return logits.gather(1, targets.unsqueeze(1)).squeeze(1) - torch.logsumexp(logits, dim=-1)
+
+    def statistical_signatures(self, texts):
+        """(avg_prob, surprise) per text; windows of all texts share batched forward passes."""
+        signatures = [(0.0, 10.0)] * len(texts)
+        windows, owners = [], []
+        for i, text in enumerate(texts):
+            tokens = self.tokenizer.encode(text)
+            if len(tokens) < 50:
+                continue
+            for window in self._windows(tokens):
+                windows.append(window)
+                owners.append(i)
+        if not windows:
+            return signatures
+
+        per_doc = {}
+        for owner, score in zip(owners, self._score_windows(windows)):
+            per_doc.setdefault(owner, []).append(score)
+        for i, scores in per_doc.items():
+            signatures[i] = (np.mean([p for p, _ in scores]), np.mean([s for _, s in scores]))
+        return signatures
+
+    def _statistical_signature(self, text):
+        return self.statistical_signatures([text])[0]
 
     def _human_noise(self, text):
         words = re.findall(r'\w+', text.lower())
@@ -136,11 +317,7 @@ class DocumentAuthenticityVerifier:
         lengths = [len(s.split()) for s in sentences]
         return np.std(lengths) if len(lengths) > 1 else 0
 
-    def verify(self, text, is_ocr=False):
-        words = re.findall(r'\w+', text)
-        if len(words) < 20:
-            return "Unable to verify (Too little text)", "N/A"
-        avg_prob, surprise = self._statistical_signature(text)
+    def _verdict(self, text, words, avg_prob, surprise, is_ocr):
         burst = self._burstiness(text)
         noise = self._human_noise(text)
         if is_ocr:
@@ -161,6 +338,23 @@ class DocumentAuthenticityVerifier:
             verdict += " (Low Confidence)"
         return verdict, f"{score:.1f}%"
 
+    def verify(self, text, is_ocr=False):
+        return self.verify_batch([text], is_ocr)[0]
+
+    def verify_batch(self, texts, is_ocr=False):
+        """verify() for several documents, scoring all of them with shared GPT-2 batches."""
+        words = [re.findall(r'\w+', t) for t in texts]
+        scorable = [i for i, w in enumerate(words) if len(w) >= 20]
+        signatures = dict(zip(scorable, self.statistical_signatures([texts[i] for i in scorable])))
+        results = []
+        for i, text in enumerate(texts):
+            if i not in signatures:
+                results.append(("Unable to verify (Too little text)", "N/A"))
+                continue
+            avg_prob, surprise = signatures[i]
+            results.append(self._verdict(text, words[i], avg_prob, surprise, is_ocr))
+        return results
+
 # =========================================================
 # PDF REPORT & EMAIL
 # =========================================================
@@ -190,8 +384,11 @@ def make_pdf_report(text, pdf_file="document_report.pdf"):
 
 def send_email(pdf_file):
     print("⚠ NOTE: Use a Gmail account with App Password (not regular password).")
-    sender = "scriptsculptor9@gmail.com"
-    password = "rtma cpxc wdfg xfym"
+    sender = os.environ.get("SMTP_USER", "")
+    password = os.environ.get("SMTP_PASSWORD", "")
+    if not (sender and password):
+        print("⚠ Set SMTP_USER and SMTP_PASSWORD to send the report by email.")
+        return
     recipient = input("Enter recipient email: ").strip()
     msg = EmailMessage()
     msg["Subject"] = "Document Verification Report"
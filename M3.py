@@ -5,14 +5,287 @@
 import os, glob, json, cv2, smtplib
 import torch
 import numpy as np
-from PIL import Image, ExifTags
+from PIL import Image
 from transformers import pipeline, CLIPProcessor, CLIPModel
-from scipy.stats import entropy
+from scipy import fft as sp_fft
+from functools import lru_cache
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
 
+from result_cache import file_sha256
+from image_embeddings import get_image_embedding_store
+from image_index import get_image_index
+
+# Images per CLIP / classifier forward pass in analyze_batch
+BATCH_SIZE = int(os.environ.get("SENTINAI_BATCH_SIZE", "8"))
+
+CLIP_MODEL_ID = "openai/clip-vit-base-patch32"
+# SENTINAI_EMBED_STORE=0 keeps CLIP embeddings in memory only (see image_embeddings.py)
+EMBED_STORE = os.environ.get("SENTINAI_EMBED_STORE", "1") == "1"
+
+# Side length the forensic stage works at; JPEGs are DCT-downscaled to no less than this
+FORENSIC_SIZE = 512
+# SENTINAI_JPEG_DRAFT=0 decodes JPEGs at full resolution
+JPEG_DRAFT = os.environ.get("SENTINAI_JPEG_DRAFT", "1") == "1"
+
+EXIF_MAKE, EXIF_MODEL = 271, 272
+EXIF_DESCRIPTION, EXIF_SOFTWARE = 270, 305
+
+# Metadata that only image generators write: A1111 "parameters", ComfyUI "prompt"/"workflow"
+GENERATOR_KEYS = ("parameters", "prompt", "workflow")
+GENERATOR_MARKERS = (
+    "stable diffusion", "midjourney", "dall-e", "dall·e", "novelai", "comfyui",
+    "automatic1111", "adobe firefly", "trainedalgorithmicmedia"
+)
+
+# Final score = weighted sub-scores minus the camera-EXIF bonus; AI_GENERATED from 60%
+SCORE_WEIGHTS = {"semantic": 0.45, "local": 0.30, "forensic": 0.15}
+EXIF_BONUS = 0.10
+AI_THRESHOLD_PERCENT = 60
+
+# Early-exit cascade (SENTINAI_CASCADE):
+#   off  - run every scorer
+#   safe - skip a model only when no score it could return would change the verdict
+#   band - also stop once the running score is more than SENTINAI_CASCADE_BAND
+#          from the threshold, with skipped models assumed at CASCADE_PRIORS
+CASCADE = os.environ.get("SENTINAI_CASCADE", "safe")
+CASCADE_BAND = float(os.environ.get("SENTINAI_CASCADE_BAND", "0.25"))
+CASCADE_PRIORS = {"semantic": 0.5, "local": 0.5, "forensic": 0.0}
+
+# Threads scipy.fft may use for a batch of spectra (-1 = all cores)
+FFT_WORKERS = int(os.environ.get("SENTINAI_FFT_WORKERS", "-1"))
+RADIAL_BANDS = 8
+JPEG_BLOCK = 8
+
+# Near-duplicate history (see image_index.py); SENTINAI_DEDUP=0 turns it off
+DEDUP = os.environ.get("SENTINAI_DEDUP", "1") == "1"
+# Earlier verdicts are reused when both perceptual hashes are within this many bits (max 3 for full recall)
+DEDUP_MAX_BITS = int(os.environ.get("SENTINAI_DEDUP_BITS", "3"))
+# ...and only when both hashes have at least this many set and unset bits: flat or
+# low-detail images (blank backgrounds) all hash to nearly the same value
+DEDUP_MIN_HASH_BITS = int(os.environ.get("SENTINAI_DEDUP_MIN_BITS", "8"))
+# CLIP cosine at which an earlier image is reported as a near duplicate (crops, edits)
+DEDUP_MIN_COSINE = float(os.environ.get("SENTINAI_DEDUP_COSINE", "0.95"))
+
+# ============================================
+# IMAGE LOADING (decode once, share with every scorer)
+# ============================================
+
+class LoadedImage:
+    """One decoded image: RGB for the models, 512×512 grayscale for forensics, EXIF flag from the header."""
+
+    def __init__(self, path, rgb, exif, sha=None, generator=None):
+        self.path = path
+        self.rgb = rgb
+        self.exif = exif
+        self.sha = sha
+        self.generator = generator
+        self._gray = None
+        self._hashes = None
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            arr = cv2.resize(np.asarray(self.rgb), (FORENSIC_SIZE, FORENSIC_SIZE))
+            self._gray = cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY)
+        return self._gray
+
+    @property
+    def hashes(self):
+        """(pHash, dHash) as 64-bit ints."""
+        if self._hashes is None:
+            self._hashes = perceptual_hashes(self.gray)
+        return self._hashes
+
+    @property
+    def hash_detail(self):
+        """Fewest set or unset bits across both hashes; near 0 for flat images."""
+        return min(min(bin(h).count("1"), 64 - bin(h).count("1")) for h in self.hashes)
+
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def perceptual_hashes(gray):
+    """
+    pHash (signs of the 8×8 lowest DCT frequencies of a 32×32 thumbnail against
+    their median) and dHash (horizontal gradient signs of a 9×8 thumbnail).
+    """
+    thumb = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(thumb)[:8, :8]
+    phash = _bits_to_int(low > np.median(low.ravel()[1:]))
+
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    dhash = _bits_to_int(small[:, 1:] > small[:, :-1])
+    return phash, dhash
+
+
+def read_exif_flag(img):
+    """True if the EXIF header names a camera Make and Model (no pixel decode needed)."""
+    try:
+        exif = img.getexif()
+        return EXIF_MAKE in exif and EXIF_MODEL in exif
+    except Exception:
+        return False
+
+
+def read_generator(img):
+    """Name of the AI generator recorded in the image metadata (PNG text, EXIF, XMP), or None."""
+    try:
+        info = img.info
+        for key in GENERATOR_KEYS:
+            if key in info:
+                return key
+        exif = img.getexif()
+        texts = [exif.get(EXIF_SOFTWARE), exif.get(EXIF_DESCRIPTION)] + list(info.values())
+        for text in texts:
+            if isinstance(text, bytes):
+                text = text.decode("utf-8", "ignore")
+            if isinstance(text, str):
+                text = text.lower()
+                for marker in GENERATOR_MARKERS:
+                    if marker in text:
+                        return marker
+    except Exception:
+        pass
+    return None
+
+
+def load_image(path, draft=JPEG_DRAFT):
+    """Decode an image once, letting the JPEG decoder downscale to the largest size any scorer needs."""
+    with Image.open(path) as img:
+        exif = read_exif_flag(img)
+        if draft and img.format == "JPEG":
+            img.draft("RGB", (FORENSIC_SIZE, FORENSIC_SIZE))
+        rgb = img.convert("RGB")
+        # PNG text chunks after the image data are only parsed once it is loaded
+        generator = read_generator(img)
+    return LoadedImage(path, rgb, exif, file_sha256(path), generator)
+
+# ============================================
+# BATCH FORENSICS
+# ============================================
+
+FORENSIC_FEATURES = (
+    ("entropy", "fft_spread")
+    + tuple(f"radial_{i}" for i in range(RADIAL_BANDS))
+    + ("jpeg_grid",)
+)
+
+
+def _histogram_entropy(stack):
+    """
+    Entropy of np.histogram(gray, 256) + 1 for every image in a uint8 stack.
+    Pixel values are counted once with a single offset bincount, then mapped
+    onto each image's own min..max bins exactly as np.histogram places them.
+    """
+    n = len(stack)
+    flat = stack.reshape(n, -1)
+    counts = np.bincount(
+        (flat + (np.arange(n, dtype=np.int64)[:, None] << 8)).ravel(), minlength=n * 256
+    ).reshape(n, 256)
+
+    lo = flat.min(axis=1).astype(np.float64)[:, None]
+    hi = flat.max(axis=1).astype(np.float64)[:, None]
+    flat_img = lo == hi
+    lo, hi = np.where(flat_img, lo - 0.5, lo), np.where(flat_img, hi + 0.5, hi)
+
+    values = np.arange(256, dtype=np.float64)[None, :]
+    step = (hi - lo) / 256
+    idx = ((values - lo) * (256 / (hi - lo))).astype(np.int64)
+    idx = np.clip(idx, 0, 255)
+    idx -= values < lo + idx * step
+    idx += (values >= lo + (idx + 1) * step) & (idx != 255)
+    idx = np.clip(idx, 0, 255)
+
+    hist = np.zeros((n, 256), dtype=np.float64)
+    np.add.at(hist, (np.arange(n)[:, None], idx), counts)
+    p = (hist + 1) / (hist + 1).sum(axis=1, keepdims=True)
+    return -(p * np.log(p)).sum(axis=1)
+
+
+@lru_cache(maxsize=4)
+def _spectrum_layout(h, w):
+    """
+    Per-column weights that turn an rfft2 half spectrum back into full-spectrum
+    statistics, plus the radial band averaging matrix for that shape.
+    """
+    cols = w // 2 + 1
+    weight = np.full(cols, 2.0, dtype=np.float32)
+    weight[0] = 1.0
+    if w % 2 == 0:
+        weight[-1] = 1.0
+    weight = np.broadcast_to(weight, (h, cols)).ravel()
+
+    radius = np.hypot(np.fft.fftfreq(h)[:, None], np.fft.rfftfreq(w)[None, :]) / 0.5
+    band = np.minimum((radius * RADIAL_BANDS).astype(np.int64), RADIAL_BANDS - 1).ravel()
+    bands = np.zeros((h * cols, RADIAL_BANDS), dtype=np.float32)
+    bands[np.arange(h * cols), band] = weight
+    bands /= bands.sum(axis=0, keepdims=True)
+    return weight, bands
+
+
+def _grid_periodicity(stack, period, workers):
+    """
+    How strongly the mean absolute pixel differences along x and y repeat every
+    `period` pixels: spectral magnitude at the block harmonics over the median
+    magnitude (about 1 for no grid). Only meaningful while the working image
+    keeps the source's block grid, e.g. when no resize was needed.
+    """
+    pixels = stack.astype(np.float32)
+    profiles = (
+        np.abs(np.diff(pixels, axis=2)).mean(axis=1),
+        np.abs(np.diff(pixels, axis=1)).mean(axis=2),
+    )
+    strength = np.zeros(len(stack), dtype=np.float32)
+    for profile in profiles:
+        length = profile.shape[1]
+        spec = np.abs(sp_fft.rfft(profile - profile.mean(axis=1, keepdims=True), axis=1, workers=workers))
+        harmonics = np.round(np.arange(1, period // 2 + 1) * length / period).astype(np.int64)
+        harmonics = harmonics[harmonics < spec.shape[1]]
+        strength += spec[:, harmonics].mean(axis=1) / (np.median(spec[:, 1:], axis=1) + 1e-6)
+    return strength / len(profiles)
+
+
+def forensic_features(grays, workers=FFT_WORKERS):
+    """
+    Forensic feature matrix (N x len(FORENSIC_FEATURES), float32) for
+    equal-size grayscale images, computed over the whole stack at once:
+
+    - entropy:    entropy of the 256-bin intensity histogram
+    - fft_spread: std of log(1 + |FFT|) over the full spectrum
+    - radial_i:   mean log-magnitude in RADIAL_BANDS rings from DC to Nyquist
+    - jpeg_grid:  periodicity of pixel differences at the 8-pixel JPEG block size
+    """
+    stack = np.ascontiguousarray(np.stack(grays), dtype=np.uint8)
+    n, h, w = stack.shape
+    weight, bands = _spectrum_layout(h, w)
+
+    spectrum = sp_fft.rfft2(stack.astype(np.float32), workers=workers)
+    logmag = np.log1p(np.abs(spectrum)).reshape(n, -1)
+    del spectrum
+
+    total = float(h * w)
+    mean = (logmag @ weight) / total
+    spread = np.sqrt(((logmag - mean[:, None]) ** 2 @ weight) / total)
+    radial = logmag @ bands
+
+    features = np.empty((n, len(FORENSIC_FEATURES)), dtype=np.float32)
+    features[:, 0] = _histogram_entropy(stack)
+    features[:, 1] = spread
+    features[:, 2:2 + RADIAL_BANDS] = radial
+    features[:, -1] = _grid_periodicity(stack, JPEG_BLOCK, workers)
+    return features
+
+
+def forensic_rule_scores(features):
+    """The forensic sub-score (0, 0.1 or 0.2) for each row of forensic_features()."""
+    score = 0.5 * (features[:, 0] < 4.3) + 0.5 * (features[:, 1] < 0.85)
+    return score * 0.2
+
 # ============================================
 # SEMANTIC + FORENSIC AI DETECTOR
 # ============================================
@@ -33,12 +306,13 @@ class SentinAIDetector:
 
         # 🔥 CLIP semantic brain
         self.clip_model = CLIPModel.from_pretrained(
-            "openai/clip-vit-base-patch32"
+            CLIP_MODEL_ID
         ).to(self.device)
 
         self.clip_processor = CLIPProcessor.from_pretrained(
-            "openai/clip-vit-base-patch32"
+            CLIP_MODEL_ID
         )
+        self.logit_scale = float(self.clip_model.logit_scale.exp())
 
         self.semantic_labels = [
             "a real photograph taken by a camera",
@@ -47,102 +321,419 @@ class SentinAIDetector:
             "a fantasy or science fiction scene",
             "a CGI render"
         ]
+        # Weight of each label's probability in the semantic AI score
+        self.semantic_weights = [
+            0.0,    # camera
+            1.0,    # AI-generated
+            0.8,    # illustration
+            0.9,    # fantasy
+            0.85    # CGI
+        ]
 
-    # ---------- SEMANTIC REALITY CHECK ----------
-    def semantic_ai_score(self, image_path):
-        image = Image.open(image_path).convert("RGB")
-
-        inputs = self.clip_processor(
-            text=self.semantic_labels,
-            images=image,
-            return_tensors="pt",
-            padding=True
-        ).to(self.device)
+        # Label prototypes and image embeddings outlive the process (image_embeddings.py)
+        self.embed_store = (
+            get_image_embedding_store(CLIP_MODEL_ID, self.clip_model.config.projection_dim)
+            if EMBED_STORE else None
+        )
+        self._label_embeds = {}
+        self.image_index = (
+            get_image_index(self.clip_model.config.projection_dim)
+            if DEDUP else None
+        )
 
-        with torch.no_grad():
-            outputs = self.clip_model(**inputs)
+    # ---------- CACHED LABEL EMBEDDINGS ----------
+    def label_embeddings(self, labels=None):
+        """Normalized text embeddings (float32 array) of a prompt list, default semantic_labels."""
+        labels = tuple(labels or self.semantic_labels)
+        if labels in self._label_embeds:
+            return self._label_embeds[labels]
+
+        emb = self.embed_store.label_prototypes(labels) if self.embed_store is not None else None
+        if emb is None:
+            inputs = self.clip_processor(
+                text=list(labels),
+                return_tensors="pt",
+                padding=True
+            ).to(self.device)
+
+            with torch.no_grad():
+                emb = self.clip_model.get_text_features(**inputs)
+
+            emb = (emb / emb.norm(dim=-1, keepdim=True)).cpu().numpy().astype(np.float32)
+            if self.embed_store is not None:
+                self.embed_store.save_label_prototypes(labels, emb)
+
+        self._label_embeds[labels] = emb
+        return emb
+
+    # ---------- IMAGE EMBEDDINGS ----------
+    def image_embeddings(self, images):
+        """
+        Normalized CLIP embeddings (float32, float16 precision) for LoadedImage
+        or PIL images. Images already in the embedding store skip the forward pass.
+        """
+        shas = [getattr(img, "sha", None) for img in images]
+        known = self.embed_store.lookup([s for s in shas if s]) if self.embed_store is not None else {}
+        todo = [i for i, sha in enumerate(shas) if sha not in known]
+
+        out = np.empty((len(images), self.clip_model.config.projection_dim), dtype=np.float32)
+        for i, sha in enumerate(shas):
+            if sha in known:
+                out[i] = known[sha]
+
+        if todo:
+            rgb = [images[i].rgb if isinstance(images[i], LoadedImage) else images[i] for i in todo]
+            inputs = self.clip_processor(images=rgb, return_tensors="pt").to(self.device)
+            with torch.no_grad():
+                emb = self.clip_model.get_image_features(**inputs)
+                emb = emb / emb.norm(dim=-1, keepdim=True)
+            # Round through float16 so fresh and stored embeddings score identically
+            emb = emb.cpu().numpy().astype(np.float16)
+            out[todo] = emb
+            if self.embed_store is not None:
+                self.embed_store.add([shas[i] for i in todo], emb)
+        return out
 
-        probs = outputs.logits_per_image.softmax(dim=1)[0].cpu().numpy()
+    # ---------- SEMANTIC REALITY CHECK ----------
+    def semantic_from_embeddings(self, emb, labels=None, weights=None):
+        """Semantic AI scores for (N x dim) image embeddings: softmax over the labels, weighted."""
+        logits = self.logit_scale * (np.asarray(emb, dtype=np.float32) @ self.label_embeddings(labels).T)
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+        return probs @ np.asarray(self.semantic_weights if weights is None else weights, dtype=np.float32)
+
+    def semantic_scores(self, images):
+        """CLIP semantic AI scores for a list of LoadedImage or RGB PIL images in one forward pass."""
+        return [float(s) for s in self.semantic_from_embeddings(self.image_embeddings(images))]
+
+    def semantic_ai_score(self, image):
+        """image: path or LoadedImage."""
+        if not isinstance(image, LoadedImage):
+            image = load_image(image)
+        return self.semantic_scores([image])[0]
+
+    def rescore_semantic(self, shas=None, labels=None, weights=None, chunk=65536):
+        """
+        Semantic scores of stored images under another prompt set and/or weights,
+        without touching the image tower. Returns {sha256: score} for `shas`
+        (default: every stored image); hashes not in the store are left out.
+        """
+        if self.embed_store is None:
+            return {}
+        stored, matrix = self.embed_store.matrix()
+        if shas is None:
+            rows = np.arange(len(stored))
+        else:
+            row_of = {sha: i for i, sha in enumerate(stored)}
+            rows = np.array([row_of[s] for s in shas if s in row_of], dtype=np.int64)
+
+        scores = {}
+        for start in range(0, len(rows), chunk):
+            part = rows[start:start + chunk]
+            for row, score in zip(part, self.semantic_from_embeddings(matrix[part], labels, weights)):
+                scores[stored[row]] = float(score)
+        return scores
 
-        score = (
-            probs[1] * 1.0 +   # AI-generated
-            probs[2] * 0.8 +   # illustration
-            probs[3] * 0.9 +   # fantasy
-            probs[4] * 0.85    # CGI
-        )
+    # ---------- LOCAL AI MODEL ----------
+    @staticmethod
+    def _pick_ai_score(res):
+        for r in res:
+            if "ai" in r["label"].lower():
+                return float(r["score"])
+        return 0.05
 
-        return float(score)
+    def local_scores(self, images):
+        """HF classifier AI scores for a list of images (PIL images or paths)."""
+        try:
+            res = self.ai_model(images, batch_size=len(images))
+            return [self._pick_ai_score(r) for r in res]
+        except:
+            return [0.05] * len(images)
 
-    # ---------- LOCAL AI MODEL ----------
-    def local_ai_score(self, image_path):
+    def local_ai_score(self, image):
+        """image: path or LoadedImage."""
         try:
-            res = self.ai_model(image_path)
-            for r in res:
-                if "ai" in r["label"].lower():
-                    return float(r["score"])
+            if isinstance(image, LoadedImage):
+                image = image.rgb
+            return self._pick_ai_score(self.ai_model(image))
         except:
             pass
         return 0.05
 
     # ---------- FORENSICS ----------
-    def forensic_score(self, image_path):
-        img = cv2.imread(image_path)
-        if img is None:
-            return 0.0
-
-        img = cv2.resize(img, (512, 512))
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        ent = entropy(np.histogram(gray, 256)[0] + 1)
-        fft = np.std(np.log(np.abs(np.fft.fftshift(np.fft.fft2(gray))) + 1))
-
-        score = 0.0
-        if ent < 4.3:
-            score += 0.5
-        if fft < 0.85:
-            score += 0.5
-
-        return score * 0.2
+    @staticmethod
+    def forensic_scores(images):
+        """Forensic sub-scores for a list of LoadedImage, computed as one batch."""
+        if not images:
+            return []
+        return [float(s) for s in forensic_rule_scores(forensic_features([img.gray for img in images]))]
+
+    def forensic_score(self, image):
+        """image: path or LoadedImage."""
+        if not isinstance(image, LoadedImage):
+            try:
+                image = load_image(image)
+            except Exception:
+                return 0.0
+        return self.forensic_scores([image])[0]
 
     # ---------- EXIF ----------
     def has_real_exif(self, path):
+        if isinstance(path, LoadedImage):
+            return path.exif
         try:
-            img = Image.open(path)
-            exif = img._getexif()
-            if not exif:
-                return False
-            tags = {ExifTags.TAGS.get(k): v for k, v in exif.items()}
-            return "Make" in tags and "Model" in tags
+            with Image.open(path) as img:
+                return read_exif_flag(img)
         except:
             return False
 
     # ---------- FINAL DECISION ----------
-    def analyze(self, image_path):
-        semantic = self.semantic_ai_score(image_path)
-        local = self.local_ai_score(image_path)
-        forensic = self.forensic_score(image_path)
-        exif = self.has_real_exif(image_path)
-
-        ai_score = (
-            semantic * 0.45 +
-            local * 0.30 +
-            forensic * 0.15
+    @staticmethod
+    def _percent(ai_score):
+        return round(min(max(ai_score, 0.01), 0.99) * 100, 1)
+
+    @staticmethod
+    def decide(image_path, semantic, local, forensic, exif, generator=None):
+        """
+        Combine sub-scores into the final verdict (no models needed, so cached
+        scores can be re-decided). A sub-score of None means that scorer was
+        skipped by the cascade and counts at its CASCADE_PRIORS value.
+        """
+        scores = {"semantic": semantic, "local": local, "forensic": forensic}
+        ai_score = sum(
+            weight * (CASCADE_PRIORS[name] if scores[name] is None else scores[name])
+            for name, weight in SCORE_WEIGHTS.items()
         )
 
         if exif:
-            ai_score -= 0.10
+            ai_score -= EXIF_BONUS
 
-        ai_score = min(max(ai_score, 0.01), 0.99)
-        percent = round(ai_score * 100, 1)
+        # Generator metadata is conclusive
+        if generator:
+            ai_score = 0.99
 
-        category = "AI_GENERATED" if percent >= 60 else "CAMERA"
+        percent = SentinAIDetector._percent(ai_score)
+
+        category = "AI_GENERATED" if percent >= AI_THRESHOLD_PERCENT else "CAMERA"
+
+        scores["exif"] = bool(exif)
+        if generator:
+            scores["generator"] = generator
 
         return {
             "filename": os.path.basename(image_path),
             "category": category,
-            "confidence_percent": percent
+            "confidence_percent": percent,
+            "scores": scores
         }
 
+    # ---------- EARLY-EXIT CASCADE ----------
+    @staticmethod
+    def cascade_exit(scores, exif, generator, mode=CASCADE, band=CASCADE_BAND):
+        """
+        Why the scorers still missing from `scores` (None values) can be skipped:
+        "generator", "bound" (no outcome of theirs changes the verdict) or
+        "band" (running score far enough from the threshold); None to go on.
+        """
+        if mode == "off":
+            return None
+        if generator:
+            return "generator"
+        # Forensics costs next to nothing next to the models, so it always runs
+        if scores["forensic"] is None:
+            return None
+
+        known = sum(w * scores[n] for n, w in SCORE_WEIGHTS.items() if scores[n] is not None)
+        unknown = {n: w for n, w in SCORE_WEIGHTS.items() if scores[n] is None}
+        known -= EXIF_BONUS if exif else 0.0
+
+        lowest = SentinAIDetector._percent(known)
+        highest = SentinAIDetector._percent(known + sum(unknown.values()))
+        if (lowest >= AI_THRESHOLD_PERCENT) == (highest >= AI_THRESHOLD_PERCENT):
+            return "bound"
+
+        if mode == "band":
+            running = known + sum(w * CASCADE_PRIORS[n] for n, w in unknown.items())
+            if abs(running * 100 - AI_THRESHOLD_PERCENT) > band * 100:
+                return "band"
+        return None
+
+    def score_images(self, images):
+        """
+        Verdicts for LoadedImages, running the scorers cheapest first over the
+        whole list (metadata, forensics, CLIP, classifier) and dropping each
+        image from later stages once cascade_exit() allows. Every result lists
+        the "stages" that ran and its "early_exit" reason (None if all ran).
+        Returns (results, CLIP embeddings or None per image).
+        """
+        n = len(images)
+        scores = [{"semantic": None, "local": None, "forensic": None} for _ in images]
+        stages = [["metadata"] for _ in images]
+        exits = [None] * n
+        embeddings = [None] * n
+
+        def still_open():
+            for i in range(n):
+                if exits[i] is None:
+                    exits[i] = self.cascade_exit(scores[i], images[i].exif, images[i].generator)
+            return [i for i in range(n) if exits[i] is None]
+
+        todo = still_open()
+        if todo:
+            for i, s in zip(todo, self.forensic_scores([images[i] for i in todo])):
+                scores[i]["forensic"] = s
+                stages[i].append("forensic")
+            todo = still_open()
+
+        if todo:
+            emb = self.image_embeddings([images[i] for i in todo])
+            for k, (i, s) in enumerate(zip(todo, self.semantic_from_embeddings(emb))):
+                scores[i]["semantic"] = float(s)
+                embeddings[i] = emb[k]
+                stages[i].append("semantic")
+            todo = still_open()
+
+        if todo:
+            for i, s in zip(todo, self.local_scores([images[i].rgb for i in todo])):
+                scores[i]["local"] = s
+                stages[i].append("local")
+
+        results = []
+        for i, img in enumerate(images):
+            result = self.decide(img.path, exif=img.exif, generator=img.generator, **scores[i])
+            result["stages"] = stages[i]
+            result["early_exit"] = exits[i]
+            results.append(result)
+        return results, embeddings
+
+    # ---------- NEAR-DUPLICATE HISTORY ----------
+    def find_duplicates(self, image, embedding=None, limit=5):
+        """Earlier images matching a LoadedImage (see ImageIndex.query); [] when the index is off."""
+        if self.image_index is None:
+            return []
+        phash, dhash = image.hashes
+        return self.image_index.query(
+            image.sha, phash, dhash, embedding,
+            max_bits=DEDUP_MAX_BITS, min_cosine=DEDUP_MIN_COSINE, limit=limit
+        )
+
+    @staticmethod
+    def _match_summary(match):
+        summary = {key: match[key] for key in ("filename", "sha256", "match", "phash_bits", "dhash_bits")}
+        if "cosine" in match:
+            summary["cosine"] = round(match["cosine"], 4)
+        return summary
+
+    def reuse_verdict(self, image):
+        """
+        The earlier verdict for an exact or near-exact copy of `image`
+        (re-decided from its stored sub-scores), or None. Needs no model.
+        Hash matches only count for images with enough detail to hash reliably
+        (DEDUP_MIN_HASH_BITS); anything else gets a fresh analysis.
+        """
+        try:
+            hash_ok = image.hash_detail >= DEDUP_MIN_HASH_BITS
+            for match in self.find_duplicates(image):
+                reusable = match["match"] == "exact" or (match["match"] == "hash" and hash_ok)
+                if reusable and match.get("scores"):
+                    # Only the model sub-scores carry over; EXIF and generator metadata
+                    # belong to this file (a re-encoded copy may have lost them)
+                    stored = match["scores"]
+                    result = self.decide(
+                        image.path,
+                        stored.get("semantic"),
+                        stored.get("local"),
+                        stored.get("forensic"),
+                        image.exif,
+                        image.generator
+                    )
+                    result["stages"] = ["metadata", "history"]
+                    result["early_exit"] = "history"
+                    result["duplicate_of"] = self._match_summary(match)
+                    print(f"[M3] {result['filename']} matches {match['filename']} ({match['match']}); verdict reused")
+                    return result
+        except Exception as e:
+            print(f"[M3] ⚠ Image history unavailable: {e}")
+        return None
+
+    def record(self, images, embeddings, results):
+        """Attach CLIP near-duplicates to fresh results, then add the images to the history."""
+        if self.image_index is None:
+            return
+        try:
+            for img, emb, result in zip(images, embeddings, results):
+                # Images that left the cascade before CLIP were already checked by hash
+                similar = self.find_duplicates(img, emb) if emb is not None else []
+                if similar:
+                    result["near_duplicates"] = [self._match_summary(m) for m in similar]
+            self.image_index.add(
+                [{"sha256": img.sha, "filename": r["filename"], "category": r["category"],
+                  "confidence_percent": r["confidence_percent"], "scores": r["scores"]}
+                 for img, r in zip(images, results)],
+                [img.hashes for img in images],
+                embeddings
+            )
+        except Exception as e:
+            print(f"[M3] ⚠ Image history unavailable: {e}")
+
+    def analyze(self, image_path):
+        image = load_image(image_path)
+
+        reused = self.reuse_verdict(image)
+        if reused:
+            return reused
+
+        results, embeddings = self.score_images([image])
+        self.record([image], embeddings, results)
+        return results[0]
+
+    # ---------- BATCH DECISION ----------
+    def analyze_batch(self, image_paths, batch_size=BATCH_SIZE, progress=None):
+        """
+        Analyze many images, running CLIP and the HF classifier on micro-batches
+        of `batch_size` images. Returns one result dict per path, in order;
+        unreadable images get category "ERROR". progress(done, total) is called
+        after each micro-batch.
+        """
+        results = []
+        total = len(image_paths)
+
+        for start in range(0, total, max(1, batch_size)):
+            chunk = image_paths[start:start + max(1, batch_size)]
+
+            images, chunk_results = [], {}
+            for path in chunk:
+                try:
+                    images.append(load_image(path))
+                except Exception as e:
+                    chunk_results[path] = {
+                        "filename": os.path.basename(path),
+                        "category": "ERROR",
+                        "confidence_percent": 0.0,
+                        "error": str(e)
+                    }
+
+            fresh = []
+            for img in images:
+                reused = self.reuse_verdict(img)
+                if reused:
+                    chunk_results[img.path] = reused
+                else:
+                    fresh.append(img)
+
+            if fresh:
+                fresh_results, embeddings = self.score_images(fresh)
+                for img, result in zip(fresh, fresh_results):
+                    chunk_results[img.path] = result
+                self.record(fresh, embeddings, fresh_results)
+
+            results.extend(chunk_results[p] for p in chunk)
+            if progress:
+                progress(len(results), total)
+
+        return results
+
 # ============================================
 # EMAIL FUNCTION
 # ============================================
@@ -193,8 +784,7 @@ def main():
     results = []
 
     print("\n🔍 Analyzing images...\n")
-    for img in images:
-        res = detector.analyze(img)
+    for res in detector.analyze_batch(images):
         print(json.dumps(res, indent=2))
         results.append(res)
 
@@ -207,8 +797,11 @@ def main():
     # Ask user to send email
     send_choice = input("\n📧 Send report via email? (y/n): ").strip().lower()
     if send_choice == "y":
-        sender = "scriptsculptor9@gmail.com"
-        password = "rtma cpxc wdfg xfym"
+        sender = os.environ.get("SMTP_USER", "")
+        password = os.environ.get("SMTP_PASSWORD", "")
+        if not (sender and password):
+            print("⚠ Set SMTP_USER and SMTP_PASSWORD to send the report by email.")
+            return
         receiver = input("Enter recipient email: ").strip()
         subject = "SentinAI Deepfake Image Report"
         body = "Attached is the deepfake analysis report generated by SentinAI v2."
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_from_directory, g, has_app_context
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import sqlite3
@@ -6,24 +6,159 @@ import os
 import datetime
 import traceback
 
+from jobs import JobQueue
+from upload_store import BlobStore, UploadRequest
+import result_cache
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'app.db')
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Whole upload request (MAX_UPLOAD_MB) and per-user stored bytes (USER_QUOTA_MB, 0 = unlimited)
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', '200'))
+USER_QUOTA_MB = int(os.environ.get('USER_QUOTA_MB', '1024'))
+
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET', 'dev-secret-key')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 2**20
 
+# Uploaded files are hashed while they stream to disk and stored once per content
+app.request_class = UploadRequest
+UploadRequest.blob_store = BlobStore(os.path.join(UPLOAD_FOLDER, '.store'))
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+
+def connect_db():
+    """A new connection; the caller closes it."""
+    conn = sqlite3.connect(DB_PATH, timeout=30)
     conn.row_factory = sqlite3.Row
+    # WAL (set once in init_db) makes NORMAL durable across application crashes
+    conn.execute('PRAGMA synchronous=NORMAL')
     return conn
 
 
+def get_db():
+    """
+    Connection for the current request, opened on first use and closed when the
+    request ends (handlers must not close it). Outside a request (background
+    jobs, startup) this returns a new connection that the caller closes.
+    """
+    if not has_app_context():
+        return connect_db()
+    if 'db' not in g:
+        g.db = connect_db()
+    return g.db
+
+
+@app.teardown_request
+def discard_uploads(exc):
+    request.discard_spools()
+
+
+@app.errorhandler(413)
+def too_large(e):
+    return jsonify({'error': e.description or 'upload too large', 'status': 'failed'}), 413
+
+
+@app.teardown_appcontext
+def close_db(exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.close()
+
+
+# Schema migrations, applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    'CREATE INDEX IF NOT EXISTS idx_logs_user_timestamp ON logs(user_id, timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs(timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)',
+    # Summary tables kept current by the triggers below, so admin views never scan users/logs/jobs
+    'CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)',
+    '''CREATE TABLE IF NOT EXISTS module_daily_stats (
+        day TEXT, module TEXT, analyses INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, module))''',
+    '''CREATE TABLE IF NOT EXISTS job_daily_stats (
+        day TEXT, module TEXT, jobs INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0,
+        total_seconds REAL NOT NULL DEFAULT 0, max_seconds REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, module))''',
+    '''CREATE TABLE IF NOT EXISTS user_stats (
+        user_id INTEGER PRIMARY KEY, analyses INTEGER NOT NULL DEFAULT 0, last_analysis TEXT)''',
+    '''INSERT OR REPLACE INTO counters (name, value) VALUES
+        ('users', (SELECT COUNT(*) FROM users)),
+        ('blocked_users', (SELECT COUNT(*) FROM users WHERE blocked = 1)),
+        ('analyses', (SELECT COUNT(*) FROM logs))''',
+    '''INSERT OR REPLACE INTO module_daily_stats (day, module, analyses)
+        SELECT substr(timestamp, 1, 10), module, COUNT(*) FROM logs GROUP BY 1, 2''',
+    '''INSERT OR REPLACE INTO user_stats (user_id, analyses, last_analysis)
+        SELECT user_id, COUNT(*), MAX(timestamp) FROM logs GROUP BY user_id''',
+    '''INSERT OR REPLACE INTO job_daily_stats (day, module, jobs, failed, total_seconds, max_seconds)
+        SELECT substr(created_at, 1, 10), module, COUNT(*), SUM(status = 'failed'),
+               SUM((julianday(updated_at) - julianday(created_at)) * 86400),
+               MAX((julianday(updated_at) - julianday(created_at)) * 86400)
+        FROM jobs WHERE status IN ('success', 'failed') GROUP BY 1, 2''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_users_insert AFTER INSERT ON users BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'users';
+        UPDATE counters SET value = value + 1 WHERE name = 'blocked_users' AND NEW.blocked = 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_users_delete AFTER DELETE ON users BEGIN
+        UPDATE counters SET value = value - 1 WHERE name = 'users';
+        UPDATE counters SET value = value - 1 WHERE name = 'blocked_users' AND OLD.blocked = 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_users_blocked AFTER UPDATE OF blocked ON users
+        WHEN (OLD.blocked = 1) != (NEW.blocked = 1) BEGIN
+        UPDATE counters SET value = value + (CASE WHEN NEW.blocked = 1 THEN 1 ELSE -1 END)
+        WHERE name = 'blocked_users';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_logs_insert AFTER INSERT ON logs BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'analyses';
+        INSERT INTO module_daily_stats (day, module, analyses) VALUES (substr(NEW.timestamp, 1, 10), NEW.module, 1)
+            ON CONFLICT (day, module) DO UPDATE SET analyses = analyses + 1;
+        INSERT INTO user_stats (user_id, analyses, last_analysis) VALUES (NEW.user_id, 1, NEW.timestamp)
+            ON CONFLICT (user_id) DO UPDATE SET analyses = analyses + 1,
+                last_analysis = MAX(COALESCE(last_analysis, ''), NEW.timestamp);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_jobs_finished AFTER UPDATE OF status ON jobs
+        WHEN NEW.status IN ('success', 'failed') AND OLD.status NOT IN ('success', 'failed') BEGIN
+        INSERT INTO job_daily_stats (day, module, jobs, failed, total_seconds, max_seconds)
+            VALUES (substr(NEW.created_at, 1, 10), NEW.module, 1, NEW.status = 'failed',
+                    (julianday(NEW.updated_at) - julianday(NEW.created_at)) * 86400,
+                    (julianday(NEW.updated_at) - julianday(NEW.created_at)) * 86400)
+            ON CONFLICT (day, module) DO UPDATE SET
+                jobs = jobs + 1,
+                failed = failed + excluded.failed,
+                total_seconds = total_seconds + excluded.total_seconds,
+                max_seconds = MAX(max_seconds, excluded.max_seconds);
+    END''',
+    '''CREATE TABLE IF NOT EXISTS uploads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        sha256 TEXT,
+        size INTEGER,
+        filename TEXT,
+        path TEXT,
+        created_at TEXT)''',
+    'CREATE INDEX IF NOT EXISTS idx_uploads_user ON uploads(user_id)',
+]
+
+ADMIN_PAGE_SIZE = 50
+ADMIN_MAX_PAGE_SIZE = 500
+USER_COLUMNS = 'users.id, users.name, users.email, users.role, users.blocked, users.last_active'
+
+
+def migrate_db(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for i, statement in enumerate(MIGRATIONS[version:], version + 1):
+        conn.execute(statement)
+        conn.execute(f'PRAGMA user_version = {i}')
+        print(f"[DB] Applied migration {i}: {statement.splitlines()[0].strip()}")
+    conn.commit()
+
+
 def init_db():
-    conn = get_db()
+    conn = connect_db()
+    # Readers (dashboards, job polling) no longer block on the analysis writers
+    conn.execute('PRAGMA journal_mode=WAL')
     cur = conn.cursor()
     cur.execute('''
     CREATE TABLE IF NOT EXISTS users (
@@ -47,12 +182,33 @@ def init_db():
         timestamp TEXT
     )
     ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER,
+        module TEXT,
+        status TEXT,
+        progress INTEGER DEFAULT 0,
+        note TEXT,
+        result TEXT,
+        score INTEGER,
+        message TEXT,
+        files INTEGER,
+        worker TEXT,
+        created_at TEXT,
+        updated_at TEXT
+    )
+    ''')
     conn.commit()
+    migrate_db(conn)
     conn.close()
 
 
 init_db()
 
+job_queue = JobQueue(connect_db)
+job_queue.fail_interrupted()
+
 
 def create_default_admin():
     """Create a default admin user if none exists. Password and email can be overridden
@@ -83,10 +239,10 @@ def current_user():
     uid = session.get('user_id')
     if not uid:
         return None
-    conn = get_db()
-    user = conn.execute('SELECT * FROM users WHERE id = ?', (uid,)).fetchone()
-    conn.close()
-    return user
+    # Looked up once per request, then shared by the decorators and the handler
+    if g.get('user') is None or g.user['id'] != uid:
+        g.user = get_db().execute('SELECT * FROM users WHERE id = ?', (uid,)).fetchone()
+    return g.user
 
 
 def login_required(fn):
@@ -136,9 +292,7 @@ def signup():
                          (name, email, pw_hash, role, datetime.datetime.utcnow().isoformat()))
             conn.commit()
         except Exception:
-            conn.close()
             return render_template('signup.html', error='Email already registered')
-        conn.close()
         return redirect(url_for('login'))
     return render_template('signup.html')
 
@@ -151,15 +305,12 @@ def login():
         conn = get_db()
         user = conn.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
         if not user or not check_password_hash(user['password'], password):
-            conn.close()
             return render_template('login.html', error='Invalid credentials')
         if user['blocked']:
-            conn.close()
             return render_template('blocked.html')
         # update last_active
         conn.execute('UPDATE users SET last_active = ? WHERE id = ?', (datetime.datetime.utcnow().isoformat(), user['id']))
         conn.commit()
-        conn.close()
         session['user_id'] = user['id']
         session['role'] = user['role']
         if user['role'] == 'admin':
@@ -180,29 +331,113 @@ def dashboard():
     user = current_user()
     conn = get_db()
     logs = conn.execute('SELECT * FROM logs WHERE user_id = ? ORDER BY timestamp DESC LIMIT 10', (user['id'],)).fetchall()
-    conn.close()
     return render_template('dashboard.html', user=user, logs=logs)
 
 
+def page_limit() -> int:
+    try:
+        limit = int(request.args.get('limit', ADMIN_PAGE_SIZE))
+    except ValueError:
+        limit = ADMIN_PAGE_SIZE
+    return max(1, min(limit, ADMIN_MAX_PAGE_SIZE))
+
+
+def read_counters(conn) -> dict:
+    return {r['name']: r['value'] for r in conn.execute('SELECT name, value FROM counters')}
+
+
+def users_page(conn, after: int = 0, limit: int = ADMIN_PAGE_SIZE):
+    """Keyset page of users with id > after, plus the cursor for the next page (None at the end)."""
+    rows = conn.execute(
+        f'SELECT {USER_COLUMNS}, COALESCE(user_stats.analyses, 0) AS analyses, user_stats.last_analysis '
+        'FROM users LEFT JOIN user_stats ON user_stats.user_id = users.id '
+        'WHERE users.id > ? ORDER BY users.id LIMIT ?', (after, limit + 1)).fetchall()
+    return rows[:limit], (rows[limit - 1]['id'] if len(rows) > limit else None)
+
+
+def logs_page(conn, before: str = None, limit: int = 200):
+    """
+    Keyset page of logs, newest first. `before` is the cursor returned for the
+    previous page ("<timestamp>|<id>"); the next cursor is None at the end.
+    """
+    query = 'SELECT logs.*, users.email as user_email FROM logs LEFT JOIN users ON logs.user_id=users.id '
+    params = []
+    if before:
+        ts, _, log_id = before.rpartition('|')
+        query += 'WHERE (logs.timestamp, logs.id) < (?, ?) '
+        params += [ts, int(log_id) if log_id.isdigit() else 0]
+    query += 'ORDER BY logs.timestamp DESC, logs.id DESC LIMIT ?'
+    rows = conn.execute(query, (*params, limit + 1)).fetchall()
+    last = rows[limit - 1] if len(rows) > limit else None
+    return rows[:limit], (f"{last['timestamp']}|{last['id']}" if last else None)
+
+
+def module_stats(conn, days: int = 14) -> dict:
+    """
+    Per-module daily analyses (log rows) and job latency for the last `days` days,
+    plus the period's average job time weighted by jobs per day.
+    """
+    since = (datetime.datetime.now() - datetime.timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    rows = conn.execute('''
+        SELECT day, module, SUM(analyses) AS analyses, SUM(jobs) AS jobs, SUM(failed) AS failed,
+               SUM(total_seconds) AS total_seconds, MAX(max_seconds) AS max_seconds
+        FROM (
+            SELECT day, module, analyses, 0 AS jobs, 0 AS failed, 0 AS total_seconds, 0 AS max_seconds
+            FROM module_daily_stats WHERE day >= ?
+            UNION ALL
+            SELECT day, module, 0, jobs, failed, total_seconds, max_seconds
+            FROM job_daily_stats WHERE day >= ?
+        ) GROUP BY day, module ORDER BY day, module
+    ''', (since, since)).fetchall()
+    stats, seconds = {}, {}
+    for r in rows:
+        module = stats.setdefault(r['module'], {'days': [], 'jobs': 0, 'avg_seconds': None, 'max_seconds': None})
+        module['days'].append({
+            'day': r['day'],
+            'analyses': r['analyses'],
+            'jobs': r['jobs'],
+            'failed': r['failed'],
+            'avg_seconds': round(r['total_seconds'] / r['jobs'], 2) if r['jobs'] else None,
+            'max_seconds': round(r['max_seconds'], 2) if r['jobs'] else None,
+        })
+        if r['jobs']:
+            module['jobs'] += r['jobs']
+            seconds[r['module']] = seconds.get(r['module'], 0.0) + r['total_seconds']
+            module['max_seconds'] = round(max(module['max_seconds'] or 0.0, r['max_seconds']), 2)
+    for name, module in stats.items():
+        if module['jobs']:
+            module['avg_seconds'] = round(seconds[name] / module['jobs'], 2)
+    return stats
+
+
 @app.route('/admin')
 @admin_required
 def admin():
     conn = get_db()
-    users = conn.execute('SELECT * FROM users').fetchall()
-    total = conn.execute('SELECT COUNT(*) as c FROM users').fetchone()['c']
-    blocked = conn.execute('SELECT COUNT(*) as c FROM users WHERE blocked=1').fetchone()['c']
-    analyses = conn.execute('SELECT COUNT(*) as c FROM logs').fetchone()['c']
-    conn.close()
-    return render_template('admin.html', users=users, total=total, blocked=blocked, analyses=analyses)
+    counters = read_counters(conn)
+    users, next_after = users_page(conn, 0, ADMIN_PAGE_SIZE)
+    return render_template('admin.html', users=users, next_after=next_after,
+                           total=counters.get('users', 0), blocked=counters.get('blocked_users', 0),
+                           analyses=counters.get('analyses', 0), stats=module_stats(conn))
 
 
 @app.route('/admin/users', methods=['GET'])
 @admin_required
 def admin_users():
+    try:
+        after = int(request.args.get('after', 0))
+    except ValueError:
+        return jsonify({'error': 'invalid cursor'}), 400
+    users, next_after = users_page(get_db(), after, page_limit())
+    return jsonify({'users': [dict(u) for u in users], 'next_after': next_after})
+
+
+@app.route('/admin/stats')
+@admin_required
+def admin_stats():
+    days = max(1, min(request.args.get('days', 14, type=int), 366))
     conn = get_db()
-    users = conn.execute('SELECT * FROM users').fetchall()
-    conn.close()
-    return jsonify([dict(u) for u in users])
+    return jsonify({'counters': read_counters(conn), 'days': days, 'modules': module_stats(conn, days)})
 
 
 @app.route('/admin/block', methods=['POST'])
@@ -216,17 +451,21 @@ def admin_block():
     else:
         conn.execute('UPDATE users SET blocked=0 WHERE id=?', (uid,))
     conn.commit()
-    conn.close()
     return jsonify({'ok': True})
 
 
 @app.route('/admin/logs')
 @admin_required
 def admin_logs():
-    conn = get_db()
-    logs = conn.execute('SELECT logs.*, users.email as user_email FROM logs LEFT JOIN users ON logs.user_id=users.id ORDER BY timestamp DESC LIMIT 200').fetchall()
-    conn.close()
-    return render_template('logs.html', logs=logs)
+    logs, next_before = logs_page(get_db(), request.args.get('before'), 200)
+    return render_template('logs.html', logs=logs, next_before=next_before)
+
+
+@app.route('/admin/api/logs')
+@admin_required
+def admin_logs_api():
+    logs, next_before = logs_page(get_db(), request.args.get('before'), page_limit())
+    return jsonify({'logs': [dict(l) for l in logs], 'next_before': next_before})
 
 
 @app.route('/upload/<module>', methods=['POST'])
@@ -234,6 +473,9 @@ def admin_logs():
 def upload(module):
     user = current_user()
     
+    if module not in ('duplicate', 'text', 'image'):
+        return jsonify({'error': 'unknown module', 'status': 'failed'}), 400
+    
     # Handle multiple files for M1 and M3, single file for M2
     if module in ['duplicate', 'image']:
         # Multiple files allowed
@@ -248,67 +490,111 @@ def upload(module):
             return jsonify({'error': 'no file', 'status': 'failed'}), 400
         files = [request.files['file']]
     
-    # Validate files
-    saved_paths = []
-    user_folder = os.path.join(app.config['UPLOAD_FOLDER'], str(user['id']))
-    os.makedirs(user_folder, exist_ok=True)
+    # The files were already hashed and spooled to disk while the request was parsed
+    incoming = [f for f in files if f.filename != '']
+    if not incoming:
+        return jsonify({'error': 'no valid files', 'status': 'failed'}), 400
+    
+    conn = get_db()
+    if USER_QUOTA_MB:
+        used = conn.execute('SELECT COALESCE(SUM(size), 0) FROM uploads WHERE user_id = ?', (user['id'],)).fetchone()[0]
+        size = sum(f.stream.size for f in incoming)
+        if used + size > USER_QUOTA_MB * 2**20:
+            return jsonify({'error': f'storage quota of {USER_QUOTA_MB} MB exceeded', 'status': 'failed'}), 413
     
-    for f in files:
-        if f.filename == '':
-            continue
+    # Each upload gets its own folder so same-named files never overwrite each other
+    store = UploadRequest.blob_store
+    upload_folder = os.path.join(app.config['UPLOAD_FOLDER'], str(user['id']),
+                                 datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f'))
+    saved_paths, rows, used_names = [], [], set()
+    timestamp = datetime.datetime.now().isoformat()
+    
+    for f in incoming:
+        spool = f.stream
+        blob, existed = store.commit(spool)
+        filename = secure_filename(f.filename) or 'upload'
+        base, ext = os.path.splitext(filename)
+        n = 2
+        while filename in used_names:
+            filename = f"{base}_{n}{ext}"
+            n += 1
+        used_names.add(filename)
         
-        filename = secure_filename(f.filename)
-        dest = os.path.join(user_folder, filename)
-        f.save(dest)
+        dest = store.link(blob, os.path.join(upload_folder, filename))
+        result_cache.register_sha256(dest, spool.sha256)
         saved_paths.append(dest)
-        print(f"[UPLOAD] Saved: {dest}")
+        rows.append((user['id'], spool.sha256, spool.size, filename, dest, timestamp))
+        print(f"[UPLOAD] Saved: {dest} ({spool.size} bytes{', deduplicated' if existed else ''})")
     
-    if not saved_paths:
-        return jsonify({'error': 'no valid files', 'status': 'failed'}), 400
+    conn.executemany('INSERT INTO uploads (user_id,sha256,size,filename,path,created_at) VALUES (?,?,?,?,?,?)', rows)
+    conn.commit()
     
-    print(f"\n[UPLOAD] Starting {module} analysis on {len(saved_paths)} file(s)")
+    print(f"\n[UPLOAD] Queueing {module} analysis on {len(saved_paths)} file(s)")
     print(f"[UPLOAD] Files: {[os.path.basename(p) for p in saved_paths]}")
     
-    # Run actual analysis
+    job_id = job_queue.submit(user['id'], module, len(saved_paths), process_upload, module, saved_paths, user['id'])
+    
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'poll_url': url_for('job_status', job_id=job_id),
+        'files': len(saved_paths)
+    }), 202
+
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    user = current_user()
+    job = job_queue.get(job_id)
+    if not job or (job['user_id'] != user['id'] and user['role'] != 'admin'):
+        return jsonify({'error': 'job not found', 'status': 'failed'}), 404
+    return jsonify({
+        'job_id': job['id'],
+        'module': job['module'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'note': job['note'],
+        'result': job['result'],
+        'score': job['score'],
+        'message': job['message'],
+        'files': job['files']
+    })
+
+
+def process_upload(module: str, saved_paths: list, user_id: int, progress=None):
+    """Job body for an upload: run the module analysis, then record one log row per file."""
     if module == 'duplicate':
         # M1 takes multiple files
-        result, score, message = run_m1_analysis(saved_paths, user['id'])
+        result, score, message = run_m1_analysis(saved_paths, user_id, progress)
     elif module == 'text':
         # M2 takes single file
-        result, score, message = run_analysis(saved_paths[0], module, user['id'])
-    elif module == 'image':
-        # M3 takes multiple image files
-        result, score, message = run_m3_analysis(saved_paths, user['id'])
+        result, score, message = run_analysis(saved_paths[0], module, user_id, progress)
     else:
-        return jsonify({'error': 'unknown module', 'status': 'failed'}), 400
+        # M3 takes multiple image files
+        result, score, message = run_m3_analysis(saved_paths, user_id, progress)
     
     # Save to database
     conn = get_db()
-    for path in saved_paths:
-        filename = os.path.basename(path)
-        conn.execute('INSERT INTO logs (user_id,module,result,score,filename,timestamp) VALUES (?,?,?,?,?,?)',
-                     (user['id'], module, result, score, filename, datetime.datetime.now().isoformat()))
+    timestamp = datetime.datetime.now().isoformat()
+    conn.executemany('INSERT INTO logs (user_id,module,result,score,filename,timestamp) VALUES (?,?,?,?,?,?)',
+                     [(user_id, module, result, score, os.path.basename(path), timestamp) for path in saved_paths])
     conn.commit()
     conn.close()
     
     print(f"[UPLOAD] Analysis complete: {result} ({score}%)\n")
-    
-    return jsonify({
-        'result': result,
-        'score': score,
-        'message': message,
-        'status': 'success' if result != 'ERROR' else 'failed',
-        'files': len(saved_paths)
-    })
+    return result, score, message
 
 
-def run_analysis(filepath: str, module: str, user_id: int):
+def run_analysis(filepath: str, module: str, user_id: int, progress=None):
     """Run the actual M1/M2/M3 analysis on uploaded file and send email report."""
     try:
         from module_wrapper import analyze_file, send_report_email
         
         print(f"[APP] Running analysis for user {user_id}: {filepath}")
         result, score, message = analyze_file(filepath, module)
+        if progress:
+            progress(90, 'Queueing report email')
         
         # Get user email for reporting
         conn = get_db()
@@ -331,7 +617,7 @@ Timestamp: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 ---
 SentinAI Omega - Enterprise AI Detection System
 """
-            print(f"[APP] Sending email to {user_email}")
+            print(f"[APP] Queueing email to {user_email}")
             send_report_email(user_email, subject, body)
         
         return result, score, message
@@ -341,13 +627,15 @@ SentinAI Omega - Enterprise AI Detection System
         return "ERROR", 0, str(e)
 
 
-def run_m1_analysis(filepaths: list, user_id: int):
+def run_m1_analysis(filepaths: list, user_id: int, progress=None):
     """Run M1 analysis on multiple document files."""
     try:
         from module_wrapper import analyze_document_m1, send_report_email
         
         print(f"[APP-M1] Running analysis for user {user_id} on {len(filepaths)} files")
         result, score, message = analyze_document_m1(filepaths)
+        if progress:
+            progress(90, 'Queueing report email')
         
         # Get user email
         conn = get_db()
@@ -371,31 +659,9 @@ Timestamp: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 ---
 SentinAI Omega - Enterprise AI Detection System
 """
-            print(f"[APP-M1] Sending email to {user_email}")
-            # Try to create a PDF report and attach it
-            try:
-                from fpdf import FPDF
-                import tempfile
-
-                pdf = FPDF()
-                pdf.add_page()
-                pdf.set_auto_page_break(auto=True, margin=15)
-                pdf.set_font("Arial", size=12)
-                for line in body.splitlines():
-                    pdf.multi_cell(0, 8, line)
-
-                tf = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-                tf_path = tf.name
-                tf.close()
-                pdf.output(tf_path)
-                send_report_email(user_email, subject, body, tf_path)
-                try:
-                    os.remove(tf_path)
-                except Exception:
-                    pass
-            except Exception as e:
-                print(f"[APP-M1] Warning: PDF generation failed: {e}")
-                send_report_email(user_email, subject, body)
+            # Queued; the mail sender renders the PDF attachment and delivers it
+            print(f"[APP-M1] Queueing email to {user_email}")
+            send_report_email(user_email, subject, body)
         
         return result, score, message
     except Exception as e:
@@ -404,19 +670,22 @@ SentinAI Omega - Enterprise AI Detection System
         return "ERROR", 0, str(e)
 
 
-def run_m3_analysis(filepaths: list, user_id: int):
+def run_m3_analysis(filepaths: list, user_id: int, progress=None):
     """Run M3 analysis on multiple image files."""
     try:
-        from module_wrapper import analyze_image_m3, send_report_email
+        from module_wrapper import analyze_images_m3, send_report_email
         
         print(f"[APP-M3] Running analysis for user {user_id} on {len(filepaths)} image(s)")
         
-        # Analyze each image and aggregate results
+        def on_batch(done, total):
+            if progress:
+                progress(5 + 85 * done // total, f'Analyzed {done}/{total} image(s)')
+        
+        # Analyze all images in micro-batches and aggregate results
         results = []
         total_score = 0
         
-        for filepath in filepaths:
-            result, score, msg = analyze_image_m3(filepath)
+        for filepath, (result, score, msg) in zip(filepaths, analyze_images_m3(filepaths, on_batch)):
             results.append({'file': os.path.basename(filepath), 'result': result, 'score': score})
             total_score += score
         
@@ -453,35 +722,9 @@ Timestamp: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 ---
 SentinAI Omega - Enterprise AI Detection System
 """
-            print(f"[APP-M3] Sending email to {user_email}")
-            # Try to create a PDF report with details and attach it
-            try:
-                from fpdf import FPDF
-                import tempfile
-
-                pdf = FPDF()
-                pdf.add_page()
-                pdf.set_auto_page_break(auto=True, margin=15)
-                pdf.set_font("Arial", size=12)
-                pdf.multi_cell(0, 8, body)
-                pdf.ln(6)
-                pdf.set_font("Arial", size=11)
-                pdf.cell(0, 6, 'Individual Results:', ln=1)
-                for r in results:
-                    pdf.multi_cell(0, 6, f" - {r['file']}: {r['result']} ({r['score']}%)")
-
-                tf = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-                tf_path = tf.name
-                tf.close()
-                pdf.output(tf_path)
-                send_report_email(user_email, subject, body, tf_path)
-                try:
-                    os.remove(tf_path)
-                except Exception:
-                    pass
-            except Exception as e:
-                print(f"[APP-M3] Warning: PDF generation failed: {e}")
-                send_report_email(user_email, subject, body)
+            # Queued; the mail sender renders the PDF attachment and delivers it
+            print(f"[APP-M3] Queueing email to {user_email}")
+            send_report_email(user_email, subject, body)
         
         return overall_result, overall_score, message
     except Exception as e:
@@ -495,5 +738,30 @@ def static_proxy(pth):
     return send_from_directory('static', pth)
 
 
+def warm_up_models():
+    """Optionally preload M2/M3 models so the first upload does not pay load time.
+    Set WARMUP_MODELS to 'all' or a comma-separated list (e.g. 'm2_verifier,m3_detector')."""
+    wanted = os.environ.get('WARMUP_MODELS', '').strip()
+    if not wanted:
+        return
+    import module_wrapper  # registers the models
+    from model_registry import warm_up_async
+    names = None if wanted.lower() == 'all' else [n.strip() for n in wanted.split(',') if n.strip()]
+    print(f"[APP] Warming up models: {names or 'all'}")
+    warm_up_async(names)
+
+
+def is_reloader_parent():
+    """True in the debug reloader's watcher process, which never serves requests."""
+    debug = app.debug or __name__ == '__main__'  # the script below always runs with debug=True
+    return debug and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+
+
+# Warm up at import so every server (gunicorn/uwsgi workers, flask run, app.run) gets it.
+# Ingest/OCR pool workers re-import this script as __mp_main__ and never serve requests
+if __name__ != '__mp_main__' and not is_reloader_parent():
+    warm_up_models()
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,277 @@
+"""
+Persistent index of every document M1 has analyzed, used to flag resubmissions.
+
+Each document is stored as its L2-normalized hashing vector (float32), a set of
+random-hyperplane LSH band keys and a metadata line. All three files are
+append-only; the metadata line is written last and acts as the commit record.
+Vectors and band keys are read through memory maps, and a query only scores
+documents that share at least one LSH band with it (plus exact SHA-256 hits),
+so lookups stay sublinear in the size of the history.
+"""
+
+import os
+import json
+import hashlib
+import datetime
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking
+    fcntl = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DOC_INDEX_DIR = os.environ.get('DOC_INDEX_DIR', os.path.join(BASE_DIR, 'doc_index'))
+
+# 24 bands of 8 hyperplane bits: ~96% recall at cosine 0.75 (the M1 threshold),
+# >99.9% at 0.90, while each band bucket holds ~1/256 of unrelated history
+LSH_BANDS = 24
+LSH_BAND_BITS = 8
+LSH_SEED = 1729
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class _FileLock:
+    """Cross-process advisory lock on a file (no-op where fcntl is unavailable)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fh = None
+
+    def __enter__(self):
+        self._fh = open(self.path, 'a')
+        if fcntl:
+            fcntl.flock(self._fh, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self._fh, fcntl.LOCK_UN)
+        self._fh.close()
+
+
+class DocumentIndex:
+    """Append-only on-disk history of analyzed documents with LSH candidate pruning."""
+
+    def __init__(self, root: str = DOC_INDEX_DIR, dim: int = 1024):
+        self.root = root
+        self.dim = dim
+        os.makedirs(root, exist_ok=True)
+        self._vec_path = os.path.join(root, 'vectors.f32')
+        self._key_path = os.path.join(root, 'lsh.u16')
+        self._meta_path = os.path.join(root, 'meta.jsonl')
+        self._file_lock = _FileLock(os.path.join(root, '.lock'))
+        self._lock = threading.RLock()
+
+        rng = np.random.default_rng(LSH_SEED)
+        self._planes = rng.standard_normal((dim, LSH_BANDS * LSH_BAND_BITS)).astype(np.float32)
+        self._bit_weights = (1 << np.arange(LSH_BAND_BITS)).astype(np.uint16)
+        self._check_config()
+
+        self._meta: List[Dict] = []
+        self._meta_offset = 0
+        self._by_sha: Dict[str, List[int]] = {}
+        self._vectors = None
+        self._keys = None
+        self._sorted_upto = 0
+        self._band_order = None
+        self._band_sorted = None
+        self._refresh()
+
+    def __len__(self):
+        return len(self._meta)
+
+    # ============================================
+    # QUERY
+    # ============================================
+
+    def query(self, vectors, shas: List[str], threshold: float = 0.75,
+              limit: int = 5) -> List[List[Tuple[Dict, float]]]:
+        """
+        For each query document return up to `limit` (metadata, cosine) matches
+        from the history with cosine >= threshold, best first.
+        """
+        with self._lock:
+            self._refresh()
+            q = self._as_dense(vectors)
+            results = []
+            if not self._meta:
+                return [[] for _ in range(q.shape[0])]
+
+            keys = self._band_keys(q)
+            self._ensure_sorted()
+            for i in range(q.shape[0]):
+                candidates = set(self._by_sha.get(shas[i], ()))
+                candidates.update(self._lsh_candidates(keys[i]))
+                if not candidates:
+                    results.append([])
+                    continue
+                rows = np.fromiter(candidates, dtype=np.int64)
+                sims = self._vectors[rows] @ q[i]
+                order = np.argsort(-sims)
+                matches = [(self._meta[rows[k]], float(min(sims[k], 1.0)))
+                           for k in order if sims[k] >= threshold][:limit]
+                results.append(matches)
+            return results
+
+    def _lsh_candidates(self, keys) -> set:
+        found = set()
+        for band in range(LSH_BANDS):
+            sorted_keys = self._band_sorted[band]
+            lo = np.searchsorted(sorted_keys, keys[band], side='left')
+            hi = np.searchsorted(sorted_keys, keys[band], side='right')
+            found.update(self._band_order[band][lo:hi].tolist())
+        # Rows appended since the last sort are scanned directly
+        if self._sorted_upto < len(self._meta):
+            tail = self._keys[self._sorted_upto:len(self._meta)]
+            hits = np.nonzero((tail == keys).any(axis=1))[0] + self._sorted_upto
+            found.update(hits.tolist())
+        return found
+
+    def _ensure_sorted(self):
+        count = len(self._meta)
+        if self._band_sorted is not None and count - self._sorted_upto <= max(1024, self._sorted_upto // 10):
+            return
+        keys = np.asarray(self._keys[:count])
+        self._band_order = [np.argsort(keys[:, b], kind='stable') for b in range(LSH_BANDS)]
+        self._band_sorted = [keys[order, b] for b, order in enumerate(self._band_order)]
+        self._sorted_upto = count
+
+    # ============================================
+    # APPEND
+    # ============================================
+
+    def add(self, names: List[str], vectors, shas: List[str], extra: Optional[Dict] = None) -> List[int]:
+        """
+        Append documents to the history; returns the new row ids. Documents whose
+        SHA-256 is already indexed (re-uploads, retried jobs) are not added again.
+        """
+        q = self._as_dense(vectors)
+        now = datetime.datetime.now().isoformat()
+
+        with self._lock, self._file_lock:
+            self._refresh()
+            seen = set(self._by_sha)
+            new = []
+            for i, sha in enumerate(shas):
+                if sha not in seen:
+                    seen.add(sha)
+                    new.append(i)
+            if not new:
+                return []
+            names = [names[i] for i in new]
+            shas = [shas[i] for i in new]
+            q = q[new]
+            keys = self._band_keys(q)
+
+            start = len(self._meta)
+            # Drop rows left behind by a writer that died before committing metadata
+            self._truncate(self._vec_path, start * self.dim * 4)
+            self._truncate(self._key_path, start * LSH_BANDS * 2)
+
+            with open(self._vec_path, 'ab') as f:
+                f.write(q.astype(np.float32).tobytes())
+            with open(self._key_path, 'ab') as f:
+                f.write(keys.astype(np.uint16).tobytes())
+            with open(self._meta_path, 'a', encoding='utf-8') as f:
+                for i, (name, sha) in enumerate(zip(names, shas)):
+                    entry = {'row': start + i, 'name': name, 'sha256': sha, 'added_at': now}
+                    entry.update(extra or {})
+                    f.write(json.dumps(entry) + '\n')
+
+            self._refresh()
+            return list(range(start, start + len(names)))
+
+    # ============================================
+    # INTERNALS
+    # ============================================
+
+    def _as_dense(self, vectors) -> np.ndarray:
+        q = vectors.toarray() if hasattr(vectors, 'toarray') else np.asarray(vectors)
+        q = np.atleast_2d(q).astype(np.float32)
+        norms = np.linalg.norm(q, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return q / norms
+
+    def _band_keys(self, q: np.ndarray) -> np.ndarray:
+        bits = (q @ self._planes) > 0
+        bits = bits.reshape(q.shape[0], LSH_BANDS, LSH_BAND_BITS)
+        return (bits * self._bit_weights).sum(axis=2).astype(np.uint16)
+
+    def _refresh(self):
+        """Pick up metadata lines committed since the last call (by any process)."""
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path, 'rb') as f:
+            f.seek(self._meta_offset)
+            chunk = f.read()
+        if not chunk:
+            return
+        # Ignore a trailing partial line from a concurrent writer
+        complete = chunk[:chunk.rfind(b'\n') + 1]
+        if not complete:
+            return
+        for line in complete.decode('utf-8').splitlines():
+            entry = json.loads(line)
+            self._meta.append(entry)
+            self._by_sha.setdefault(entry['sha256'], []).append(entry['row'])
+        self._meta_offset += len(complete)
+
+        count = len(self._meta)
+        self._vectors = np.memmap(self._vec_path, dtype=np.float32, mode='r', shape=(count, self.dim))
+        self._keys = np.memmap(self._key_path, dtype=np.uint16, mode='r', shape=(count, LSH_BANDS))
+
+    def _check_config(self):
+        path = os.path.join(self.root, 'config.json')
+        config = {'dim': self.dim, 'bands': LSH_BANDS, 'band_bits': LSH_BAND_BITS, 'seed': LSH_SEED}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored.get('dim') != self.dim:
+                raise ValueError(f"Document index at {self.root} was built with {stored}, expected {config}")
+            if stored != config:
+                self._rebuild_keys(stored)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+
+    def _rebuild_keys(self, stored):
+        """Recompute the band keys of every stored vector after the LSH layout changed."""
+        with self._file_lock:
+            count = 0
+            if os.path.exists(self._meta_path):
+                with open(self._meta_path, 'rb') as f:
+                    count = f.read().count(b'\n')
+            print(f"[INDEX] LSH layout changed ({stored} -> {LSH_BANDS}x{LSH_BAND_BITS}); "
+                  f"rebuilding keys for {count} document(s)")
+            tmp = self._key_path + '.rebuild'
+            with open(tmp, 'wb') as out:
+                if count:
+                    vectors = np.memmap(self._vec_path, dtype=np.float32, mode='r', shape=(count, self.dim))
+                    for start in range(0, count, 65536):
+                        out.write(self._band_keys(np.asarray(vectors[start:start + 65536])).tobytes())
+            os.replace(tmp, self._key_path)
+
+    @staticmethod
+    def _truncate(path, size):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_document_index(dim: int = 1024) -> DocumentIndex:
+    """Process-wide DocumentIndex over DOC_INDEX_DIR."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DocumentIndex(DOC_INDEX_DIR, dim)
+        return _index
@@ -0,0 +1,176 @@
+"""
+On-disk CLIP embeddings for M3.
+
+Label prototypes (the normalized text embeddings of a prompt set) are saved
+once per model and prompt list, so the text tower only runs for prompt sets
+that have never been seen. Image embeddings are appended to a float16 matrix
+that is read through a memory map and keyed by the SHA-256 of the image file;
+re-scoring stored images against new prompts or weights is then a single
+matrix multiply instead of a CLIP forward pass.
+
+Layout follows doc_index.py: embeddings.f16 and meta.jsonl are append-only and
+the metadata line is written last, acting as the commit record.
+"""
+
+import os
+import json
+import hashlib
+import datetime
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from doc_index import _FileLock
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_EMBED_DIR = os.environ.get('IMAGE_EMBED_DIR', os.path.join(BASE_DIR, 'image_embeddings'))
+
+
+def prompt_set_key(model: str, labels: Sequence[str]) -> str:
+    return hashlib.sha256(json.dumps([model, list(labels)]).encode('utf-8')).hexdigest()[:16]
+
+
+class ImageEmbeddingStore:
+    """Append-only float16 image embeddings keyed by file SHA-256, plus saved label prototypes."""
+
+    def __init__(self, root: str = IMAGE_EMBED_DIR, model: str = '', dim: int = 512):
+        self.root = root
+        self.model = model
+        self.dim = dim
+        os.makedirs(os.path.join(root, 'labels'), exist_ok=True)
+        self._vec_path = os.path.join(root, 'embeddings.f16')
+        self._meta_path = os.path.join(root, 'meta.jsonl')
+        self._file_lock = _FileLock(os.path.join(root, '.lock'))
+        self._lock = threading.RLock()
+        self._check_config()
+
+        self._shas: List[str] = []
+        self._row_of: Dict[str, int] = {}
+        self._meta_offset = 0
+        self._vectors = None
+        self._refresh()
+
+    def __len__(self):
+        return len(self._shas)
+
+    # ============================================
+    # LABEL PROTOTYPES
+    # ============================================
+
+    def label_prototypes(self, labels: Sequence[str]) -> Optional[np.ndarray]:
+        """Saved (len(labels) x dim) float32 text embeddings for this prompt list, or None."""
+        path = os.path.join(self.root, 'labels', prompt_set_key(self.model, labels) + '.npy')
+        if not os.path.exists(path):
+            return None
+        emb = np.load(path)
+        return emb if emb.shape == (len(labels), self.dim) else None
+
+    def save_label_prototypes(self, labels: Sequence[str], embeddings) -> None:
+        key = prompt_set_key(self.model, labels)
+        path = os.path.join(self.root, 'labels', key + '.npy')
+        tmp = path + f'.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, np.asarray(embeddings, dtype=np.float32))
+        os.replace(tmp, path)
+        with open(os.path.join(self.root, 'labels', key + '.json'), 'w', encoding='utf-8') as f:
+            json.dump({'model': self.model, 'labels': list(labels)}, f, indent=2)
+
+    # ============================================
+    # IMAGE EMBEDDINGS
+    # ============================================
+
+    def lookup(self, shas: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Stored embeddings (float32) for whichever of `shas` are known."""
+        with self._lock:
+            self._refresh()
+            return {sha: np.asarray(self._vectors[self._row_of[sha]], dtype=np.float32)
+                    for sha in shas if sha in self._row_of}
+
+    def add(self, shas: Sequence[str], embeddings) -> int:
+        """Append embeddings for hashes not stored yet; returns how many were written."""
+        emb = np.atleast_2d(np.asarray(embeddings, dtype=np.float16))
+        now = datetime.datetime.now().isoformat()
+
+        with self._lock, self._file_lock:
+            self._refresh()
+            seen = set(self._row_of)
+            new = []
+            for i, sha in enumerate(shas):
+                if sha and sha not in seen:
+                    seen.add(sha)
+                    new.append(i)
+            if not new:
+                return 0
+
+            start = len(self._shas)
+            # Drop rows left behind by a writer that died before committing metadata
+            if os.path.exists(self._vec_path) and os.path.getsize(self._vec_path) > start * self.dim * 2:
+                with open(self._vec_path, 'r+b') as f:
+                    f.truncate(start * self.dim * 2)
+
+            with open(self._vec_path, 'ab') as f:
+                f.write(emb[new].tobytes())
+            with open(self._meta_path, 'a', encoding='utf-8') as f:
+                for k, i in enumerate(new):
+                    f.write(json.dumps({'row': start + k, 'sha256': shas[i], 'added_at': now}) + '\n')
+
+            self._refresh()
+            return len(new)
+
+    def matrix(self):
+        """(shas, float16 memmap of their embeddings) for every stored image, in row order."""
+        with self._lock:
+            self._refresh()
+            return list(self._shas), self._vectors
+
+    # ============================================
+    # INTERNALS
+    # ============================================
+
+    def _refresh(self):
+        """Pick up metadata lines committed since the last call (by any process)."""
+        if not os.path.exists(self._meta_path):
+            self._vectors = np.zeros((0, self.dim), dtype=np.float16)
+            return
+        with open(self._meta_path, 'rb') as f:
+            f.seek(self._meta_offset)
+            chunk = f.read()
+        # Ignore a trailing partial line from a concurrent writer
+        complete = chunk[:chunk.rfind(b'\n') + 1]
+        if not complete and self._vectors is not None:
+            return
+        for line in complete.decode('utf-8').splitlines():
+            entry = json.loads(line)
+            self._row_of[entry['sha256']] = entry['row']
+            self._shas.append(entry['sha256'])
+        self._meta_offset += len(complete)
+
+        count = len(self._shas)
+        self._vectors = (np.memmap(self._vec_path, dtype=np.float16, mode='r', shape=(count, self.dim))
+                         if count else np.zeros((0, self.dim), dtype=np.float16))
+
+    def _check_config(self):
+        path = os.path.join(self.root, 'config.json')
+        config = {'model': self.model, 'dim': self.dim}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored != config:
+                raise ValueError(f"Image embedding store at {self.root} was built with {stored}, expected {config}")
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(config, f)
+
+
+_stores: Dict[str, ImageEmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_image_embedding_store(model: str, dim: int) -> ImageEmbeddingStore:
+    """Process-wide store for `model` under IMAGE_EMBED_DIR/<model name>."""
+    with _stores_lock:
+        if model not in _stores:
+            root = os.path.join(IMAGE_EMBED_DIR, model.replace('/', '__'))
+            _stores[model] = ImageEmbeddingStore(root, model, dim)
+        return _stores[model]
@@ -0,0 +1,286 @@
+"""
+Persistent near-duplicate index of every image M3 has analyzed.
+
+Each image is stored with its perceptual hashes (64-bit pHash and dHash), its
+CLIP embedding (float16), a row of uint16 lookup keys and a metadata line that
+carries the verdict. The keys are the four 16-bit chunks of each hash followed
+by random-hyperplane LSH bands of the embedding, so a query only looks at
+images that share a key with it:
+
+- any image within 3 bits of the query's pHash or dHash shares at least one
+  hash chunk with it (pigeonhole), which catches re-encodes and resizes;
+- images with similar embeddings (crops, light edits) tend to share an LSH
+  band.
+
+Storage mirrors doc_index.py: append-only files, metadata written last as the
+commit record, memory-mapped reads.
+"""
+
+import os
+import json
+import datetime
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from doc_index import _FileLock
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_INDEX_DIR = os.environ.get('IMAGE_INDEX_DIR', os.path.join(BASE_DIR, 'image_index'))
+
+HASH_CHUNKS = 4            # 16-bit chunks per 64-bit perceptual hash
+LSH_BANDS = 12
+LSH_BAND_BITS = 12
+LSH_SEED = 2718
+KEY_COLUMNS = 2 * HASH_CHUNKS + LSH_BANDS
+NO_EMBEDDING = 0xFFFF      # LSH key of rows stored without an embedding (never produced by a band)
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def hamming(a, b) -> np.ndarray:
+    """Bit distance between uint64 hashes (broadcasting)."""
+    x = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64))
+    x = np.atleast_1d(x)
+    return _POPCOUNT[x.view(np.uint8).reshape(x.shape + (8,))].sum(axis=-1)
+
+
+class ImageIndex:
+    """Append-only on-disk history of analyzed images with hash and LSH candidate pruning."""
+
+    def __init__(self, root: str = IMAGE_INDEX_DIR, dim: int = 512):
+        self.root = root
+        self.dim = dim
+        os.makedirs(root, exist_ok=True)
+        self._hash_path = os.path.join(root, 'hashes.u64')
+        self._vec_path = os.path.join(root, 'vectors.f16')
+        self._key_path = os.path.join(root, 'keys.u16')
+        self._meta_path = os.path.join(root, 'meta.jsonl')
+        self._file_lock = _FileLock(os.path.join(root, '.lock'))
+        self._lock = threading.RLock()
+        self._check_config()
+
+        rng = np.random.default_rng(LSH_SEED)
+        self._planes = rng.standard_normal((dim, LSH_BANDS * LSH_BAND_BITS)).astype(np.float32)
+        self._bit_weights = (1 << np.arange(LSH_BAND_BITS)).astype(np.uint16)
+
+        self._meta: List[Dict] = []
+        self._meta_offset = 0
+        self._by_sha: Dict[str, int] = {}
+        self._hashes = None
+        self._vectors = None
+        self._keys = None
+        self._sorted_upto = 0
+        self._key_order = None
+        self._key_sorted = None
+        self._refresh()
+
+    def __len__(self):
+        return len(self._meta)
+
+    # ============================================
+    # QUERY
+    # ============================================
+
+    def query(self, sha: str, phash: int, dhash: int, embedding=None, max_bits: int = 3,
+              min_cosine: float = 0.95, limit: int = 5) -> List[Dict]:
+        """
+        Earlier images that match one query image, best first. Each match is its
+        metadata plus 'match' ("exact", "hash" or "embedding"), 'phash_bits',
+        'dhash_bits' and, when an embedding is given, 'cosine'.
+
+        "hash" needs both hashes within max_bits; "embedding" needs cosine >= min_cosine.
+        """
+        with self._lock:
+            self._refresh()
+            if not self._meta:
+                return []
+            keys = self._row_keys(np.array([[phash, dhash]], dtype=np.uint64),
+                                  None if embedding is None else self._normalize(embedding))[0]
+            columns = KEY_COLUMNS if embedding is not None else 2 * HASH_CHUNKS
+            self._ensure_sorted()
+
+            candidates = self._candidates(keys, columns)
+            if sha in self._by_sha:
+                candidates.add(self._by_sha[sha])
+            if not candidates:
+                return []
+
+            rows = np.fromiter(candidates, dtype=np.int64)
+            p_bits = hamming(self._hashes[rows, 0], phash)
+            d_bits = hamming(self._hashes[rows, 1], dhash)
+            cosine = None
+            if embedding is not None:
+                cosine = np.asarray(self._vectors[rows], dtype=np.float32) @ self._normalize(embedding)[0]
+
+            matches = []
+            for k, row in enumerate(rows):
+                entry = self._meta[row]
+                if entry['sha256'] == sha:
+                    kind = 'exact'
+                elif p_bits[k] <= max_bits and d_bits[k] <= max_bits:
+                    kind = 'hash'
+                elif cosine is not None and cosine[k] >= min_cosine:
+                    kind = 'embedding'
+                else:
+                    continue
+                match = dict(entry, match=kind, phash_bits=int(p_bits[k]), dhash_bits=int(d_bits[k]))
+                if cosine is not None:
+                    match['cosine'] = float(min(cosine[k], 1.0))
+                matches.append(match)
+
+            rank = {'exact': 0, 'hash': 1, 'embedding': 2}
+            matches.sort(key=lambda m: (rank[m['match']], m['phash_bits'] + m['dhash_bits'], -m.get('cosine', 0.0)))
+            return matches[:limit]
+
+    def _candidates(self, keys, columns: int) -> set:
+        found = set()
+        for col in range(columns):
+            sorted_keys = self._key_sorted[col]
+            lo = np.searchsorted(sorted_keys, keys[col], side='left')
+            hi = np.searchsorted(sorted_keys, keys[col], side='right')
+            found.update(self._key_order[col][lo:hi].tolist())
+        # Rows appended since the last sort are scanned directly
+        if self._sorted_upto < len(self._meta):
+            tail = self._keys[self._sorted_upto:len(self._meta), :columns]
+            hits = np.nonzero((tail == keys[:columns]).any(axis=1))[0] + self._sorted_upto
+            found.update(hits.tolist())
+        return found
+
+    def _ensure_sorted(self):
+        count = len(self._meta)
+        if self._key_sorted is not None and count - self._sorted_upto <= max(1024, self._sorted_upto // 10):
+            return
+        keys = np.asarray(self._keys[:count])
+        self._key_order = [np.argsort(keys[:, c], kind='stable') for c in range(KEY_COLUMNS)]
+        self._key_sorted = [keys[order, c] for c, order in enumerate(self._key_order)]
+        self._sorted_upto = count
+
+    # ============================================
+    # APPEND
+    # ============================================
+
+    def add(self, entries: List[Dict], hashes, embeddings) -> List[int]:
+        """
+        Append images to the history. entries[i] is the metadata to keep (must
+        include 'sha256'); hashes is (N x 2) [pHash, dHash]; embeddings[i] may be
+        None, leaving that image to hash matching only. Images whose SHA-256
+        is already indexed are skipped. Returns the new row ids.
+        """
+        hashes = np.atleast_2d(np.asarray(hashes, dtype=np.uint64))
+        has_vector = np.array([e is not None for e in embeddings], dtype=bool)
+        vectors = np.zeros((len(entries), self.dim), dtype=np.float32)
+        if has_vector.any():
+            vectors[has_vector] = self._normalize([e for e in embeddings if e is not None])
+        now = datetime.datetime.now().isoformat()
+
+        with self._lock, self._file_lock:
+            self._refresh()
+            seen = set(self._by_sha)
+            new = []
+            for i, entry in enumerate(entries):
+                if entry['sha256'] not in seen:
+                    seen.add(entry['sha256'])
+                    new.append(i)
+            if not new:
+                return []
+
+            start = len(self._meta)
+            # Drop rows left behind by a writer that died before committing metadata
+            self._truncate(self._hash_path, start * 2 * 8)
+            self._truncate(self._vec_path, start * self.dim * 2)
+            self._truncate(self._key_path, start * KEY_COLUMNS * 2)
+
+            keys = self._row_keys(hashes[new], vectors[new])
+            keys[~has_vector[new], 2 * HASH_CHUNKS:] = NO_EMBEDDING
+            with open(self._hash_path, 'ab') as f:
+                f.write(hashes[new].tobytes())
+            with open(self._vec_path, 'ab') as f:
+                f.write(vectors[new].astype(np.float16).tobytes())
+            with open(self._key_path, 'ab') as f:
+                f.write(keys.tobytes())
+            with open(self._meta_path, 'a', encoding='utf-8') as f:
+                for k, i in enumerate(new):
+                    entry = dict(entries[i], row=start + k, added_at=now)
+                    f.write(json.dumps(entry) + '\n')
+
+            self._refresh()
+            return list(range(start, start + len(new)))
+
+    # ============================================
+    # INTERNALS
+    # ============================================
+
+    def _normalize(self, vectors) -> np.ndarray:
+        q = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(q, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return q / norms
+
+    def _row_keys(self, hashes: np.ndarray, vectors: Optional[np.ndarray]) -> np.ndarray:
+        n = len(hashes)
+        keys = np.zeros((n, KEY_COLUMNS), dtype=np.uint16)
+        for h in range(2):
+            for c in range(HASH_CHUNKS):
+                keys[:, h * HASH_CHUNKS + c] = (hashes[:, h] >> np.uint64(16 * c)) & np.uint64(0xFFFF)
+        if vectors is not None:
+            bits = ((vectors @ self._planes) > 0).reshape(n, LSH_BANDS, LSH_BAND_BITS)
+            keys[:, 2 * HASH_CHUNKS:] = (bits * self._bit_weights).sum(axis=2)
+        return keys
+
+    def _refresh(self):
+        """Pick up metadata lines committed since the last call (by any process)."""
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path, 'rb') as f:
+            f.seek(self._meta_offset)
+            chunk = f.read()
+        if not chunk:
+            return
+        # Ignore a trailing partial line from a concurrent writer
+        complete = chunk[:chunk.rfind(b'\n') + 1]
+        if not complete:
+            return
+        for line in complete.decode('utf-8').splitlines():
+            entry = json.loads(line)
+            self._meta.append(entry)
+            self._by_sha[entry['sha256']] = entry['row']
+        self._meta_offset += len(complete)
+
+        count = len(self._meta)
+        self._hashes = np.memmap(self._hash_path, dtype=np.uint64, mode='r', shape=(count, 2))
+        self._vectors = np.memmap(self._vec_path, dtype=np.float16, mode='r', shape=(count, self.dim))
+        self._keys = np.memmap(self._key_path, dtype=np.uint16, mode='r', shape=(count, KEY_COLUMNS))
+
+    def _check_config(self):
+        path = os.path.join(self.root, 'config.json')
+        config = {'dim': self.dim, 'hash_chunks': HASH_CHUNKS, 'bands': LSH_BANDS,
+                  'band_bits': LSH_BAND_BITS, 'seed': LSH_SEED}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored != config:
+                raise ValueError(f"Image index at {self.root} was built with {stored}, expected {config}")
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(config, f)
+
+    @staticmethod
+    def _truncate(path, size):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_image_index(dim: int = 512) -> ImageIndex:
+    """Process-wide ImageIndex over IMAGE_INDEX_DIR."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ImageIndex(IMAGE_INDEX_DIR, dim)
+        return _index
@@ -0,0 +1,137 @@
+"""
+Parallel read + clean stage for M1.
+
+Parsing PDFs and DOCX files dominates M1's wall time on large batches, so
+ingest_files() fans reading and cleaning out over a process pool. At most
+2 x workers files are in flight and results come back in input order. A file
+that cannot be read is reported with its error instead of being dropped.
+
+Kept free of sklearn/scipy imports so that worker processes, which are
+started with "forkserver" (or "spawn" where that is unavailable), come up
+quickly.
+"""
+
+import os
+import re
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, List, Optional, Tuple
+
+from text_extract import read_text
+
+# Worker processes for ingestion (INGEST_WORKERS, default: up to 4 CPUs).
+# 1 reads files in the calling process.
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+
+# Workers are never forked from the (multi-threaded) server process: a forked
+# child inherits any lock another thread happens to hold and can deadlock
+MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def clean_text(text):
+    text = re.sub(r'\b(id|roll|reg|registration|date|sl|no)[\s:]*\d+\b', '', text, flags=re.I)
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def read_and_clean(path: str) -> Tuple[Optional[str], Optional[str]]:
+    """(cleaned text, None) for a readable file, (None, error) otherwise."""
+    try:
+        return clean_text(read_text(path)), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=INGEST_WORKERS, mp_context=MP_CONTEXT)
+        return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False)
+
+
+def ingest_files(paths: List[str], workers: Optional[int] = None) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+    """
+    Yield (path, cleaned text, error) for every path, in input order.
+    Exactly one of text and error is None.
+    """
+    workers = workers or INGEST_WORKERS
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield (path,) + read_and_clean(path)
+        return
+
+    yield from _ingest_with(paths, workers, shared=workers == INGEST_WORKERS)
+
+
+def _ingest_with(paths, workers, shared):
+    """
+    Run read_and_clean over paths on the shared pool (or a private one). If a
+    worker dies, only the files in flight on that pool are reported as crashed;
+    the rest go to a fresh pool.
+    """
+    own_pools = []
+
+    def new_pool():
+        if shared:
+            return _get_pool()
+        own_pools.append(ProcessPoolExecutor(max_workers=workers, mp_context=MP_CONTEXT))
+        return own_pools[-1]
+
+    def replace(broken):
+        nonlocal pool
+        if pool is broken:
+            if shared:
+                _reset_pool(broken)
+            else:
+                broken.shutdown(wait=False)
+            pool = new_pool()
+
+    pool = new_pool()
+    pending = deque()
+    remaining = iter(paths)
+
+    def submit_next():
+        path = next(remaining, None)
+        if path is None:
+            return
+        try:
+            pending.append((path, pool, pool.submit(read_and_clean, path)))
+        except BrokenProcessPool:
+            # Broke before any of its futures told us; retry once on a fresh pool
+            replace(pool)
+            pending.append((path, pool, pool.submit(read_and_clean, path)))
+
+    try:
+        for _ in range(workers * 2):
+            submit_next()
+
+        while pending:
+            path, submitted_to, future = pending.popleft()
+            try:
+                text, error = future.result()
+            except BrokenProcessPool as e:
+                # A worker died (e.g. out of memory) with this file in flight
+                replace(submitted_to)
+                text, error = None, f"worker crashed: {e}"
+            except Exception as e:
+                text, error = None, f"{type(e).__name__}: {e}"
+            yield path, text, error
+            submit_next()
+    finally:
+        for own in own_pools:
+            own.shutdown(wait=own is pool)
@@ -0,0 +1,117 @@
+"""
+Background job queue for uploads.
+
+Uploads are saved by the request handler and handed to a local worker pool;
+the request returns a job id immediately and the browser polls /jobs/<id>.
+Job state (status, progress, result) lives in the `jobs` table of app.db so
+any request thread can read it.
+"""
+
+import os
+import uuid
+import datetime
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# Threads (not processes) so the workers share the models held in model_registry
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+
+# Identifies this process across PID reuse (e.g. container restarts)
+WORKER_ID = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _now() -> str:
+    return datetime.datetime.now().isoformat()
+
+
+def _worker_alive(worker: Optional[str]) -> bool:
+    if not worker:
+        return False
+    if worker == WORKER_ID:
+        return True
+    pid = worker.split(':', 1)[0]
+    if pid == str(os.getpid()):
+        # Same PID but a different boot: the owner was an earlier run of this process
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+class JobQueue:
+    """Runs upload analyses on a thread pool and records their progress in SQLite."""
+
+    def __init__(self, connect: Callable, workers: int = JOB_WORKERS):
+        self._connect = connect
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='job')
+        print(f"[JOBS] Job queue ready with {max(1, workers)} worker(s)")
+
+    def fail_interrupted(self) -> int:
+        """Mark queued/running jobs whose owning process has died as failed."""
+        conn = self._connect()
+        rows = conn.execute("SELECT id, worker FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        stale = [(_now(), r['id']) for r in rows if not _worker_alive(r['worker'])]
+        if stale:
+            conn.executemany(
+                "UPDATE jobs SET status='failed', result='ERROR', score=0, progress=100, "
+                "message='Job interrupted by server restart', updated_at=? WHERE id=?", stale)
+            conn.commit()
+            print(f"[JOBS] Marked {len(stale)} interrupted job(s) as failed")
+        conn.close()
+        return len(stale)
+
+    def submit(self, user_id: int, module: str, files: int, fn: Callable, *args) -> str:
+        """
+        Queue fn(*args, progress=callback) and return the new job id.
+
+        fn must return (result, score, message) like the module wrappers do.
+        """
+        job_id = uuid.uuid4().hex
+        now = _now()
+        conn = self._connect()
+        conn.execute(
+            'INSERT INTO jobs (id,user_id,module,status,progress,note,files,worker,created_at,updated_at) '
+            'VALUES (?,?,?,?,?,?,?,?,?,?)',
+            (job_id, user_id, module, 'queued', 0, 'Queued', files, WORKER_ID, now, now))
+        conn.commit()
+        conn.close()
+        self._pool.submit(self._run, job_id, fn, args)
+        print(f"[JOBS] Queued job {job_id} ({module}, {files} file(s))")
+        return job_id
+
+    def set_progress(self, job_id: str, progress: int, note: Optional[str] = None) -> None:
+        fields = {'progress': max(0, min(99, int(progress)))}
+        if note:
+            fields['note'] = note
+        self._update(job_id, **fields)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def _run(self, job_id: str, fn: Callable, args: tuple) -> None:
+        self._update(job_id, status='running', progress=5, note='Running analysis')
+        try:
+            result, score, message = fn(*args, progress=lambda pct, note=None: self.set_progress(job_id, pct, note))
+            status = 'failed' if result == 'ERROR' else 'success'
+            self._update(job_id, status=status, progress=100, note='Done',
+                         result=result, score=score, message=message)
+            print(f"[JOBS] Job {job_id} finished: {result} ({score}%)")
+        except Exception as e:
+            print(f"[JOBS] Job {job_id} crashed: {e}")
+            traceback.print_exc()
+            self._update(job_id, status='failed', progress=100, note='Failed',
+                         result='ERROR', score=0, message=str(e))
+
+    def _update(self, job_id: str, **fields) -> None:
+        fields['updated_at'] = _now()
+        cols = ', '.join(f'{k} = ?' for k in fields)
+        conn = self._connect()
+        conn.execute(f'UPDATE jobs SET {cols} WHERE id = ?', (*fields.values(), job_id))
+        conn.commit()
+        conn.close()
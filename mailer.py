@@ -0,0 +1,316 @@
+"""
+Outbound mail queue for analysis reports.
+
+send_report_email() only inserts a row into a small SQLite outbox and returns;
+a background sender thread delivers due messages over one SMTP connection that
+it keeps open between sends. Reports queued for the same recipient within
+MAIL_BATCH_DELAY seconds go out as a single email with every attachment, and
+failed sends are retried with exponential backoff.
+
+Credentials come only from the environment (SMTP_USER, SMTP_PASSWORD). While
+they are unset, messages stay queued and the sender logs a warning. Point
+SMTP_HOST/SMTP_PORT at a local stand-in (e.g. `python -m aiosmtpd -n -l
+localhost:8025`) with SMTP_STARTTLS=0 and SMTP_AUTH=0 to test delivery without
+a real mail server.
+
+Several processes (WSGI workers, the reloader parent and child) may run a
+sender on the same outbox. Each claims due rows in one BEGIN IMMEDIATE
+transaction, tagging them with its own claim id, and only sends the rows it
+claimed. Rows left in 'sending' by a sender that died are released once their
+claim is older than MAIL_CLAIM_LEASE.
+"""
+
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import smtplib
+import datetime
+import threading
+import traceback
+from email.message import EmailMessage
+from typing import Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MAIL_QUEUE_PATH = os.environ.get('MAIL_QUEUE_PATH', os.path.join(BASE_DIR, 'mail_queue.db'))
+
+SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') == '1'
+SMTP_USER = os.environ.get('SMTP_USER', '')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', '')  # e.g. a Gmail app password
+# SMTP_AUTH=0 sends without logging in (local test servers)
+SMTP_AUTH = os.environ.get('SMTP_AUTH', '1') == '1'
+MAIL_FROM = os.environ.get('MAIL_FROM', SMTP_USER or 'sentinai@localhost')
+
+# Seconds a new message waits so that reports for the same recipient can be batched
+MAIL_BATCH_DELAY = float(os.environ.get('MAIL_BATCH_DELAY', '5'))
+MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', '5'))
+MAIL_RETRY_BASE = float(os.environ.get('MAIL_RETRY_BASE', '30'))   # seconds, doubled per attempt
+# Close the pooled SMTP connection after this many idle seconds
+SMTP_IDLE_TIMEOUT = float(os.environ.get('SMTP_IDLE_TIMEOUT', '60'))
+# Seconds after which a claimed but unfinished message is handed to another sender
+MAIL_CLAIM_LEASE = float(os.environ.get('MAIL_CLAIM_LEASE', '600'))
+
+_initialized = False
+_init_lock = threading.Lock()
+
+
+def _connect():
+    global _initialized
+    conn = sqlite3.connect(MAIL_QUEUE_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    with _init_lock:
+        if not _initialized:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipient TEXT NOT NULL,
+                subject TEXT,
+                body TEXT,
+                attachment BLOB,
+                attachment_name TEXT,
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                next_attempt REAL,
+                last_error TEXT,
+                created_at TEXT,
+                sent_at TEXT,
+                claimed_by TEXT,
+                claimed_at REAL
+            )
+            ''')
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(outbox)')}
+            for column, kind in (('claimed_by', 'TEXT'), ('claimed_at', 'REAL')):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE outbox ADD COLUMN {column} {kind}')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt)')
+            conn.commit()
+            _initialized = True
+    return conn
+
+
+def report_pdf(body: str) -> bytes:
+    """Render a report body as a simple one-column PDF, in memory."""
+    from fpdf import FPDF
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.set_font("Arial", size=12)
+    for line in body.splitlines():
+        # The core fonts only cover latin-1
+        pdf.multi_cell(0, 8, line.replace('•', '-').encode('latin-1', 'replace').decode('latin-1'))
+    out = pdf.output(dest='S')
+    return out.encode('latin-1') if isinstance(out, str) else bytes(out)
+
+
+def enqueue(recipient: str, subject: str, body: str, attachment: Optional[bytes] = None,
+            attachment_name: Optional[str] = None) -> int:
+    """Queue a message for the background sender; returns its outbox id."""
+    conn = _connect()
+    cur = conn.execute(
+        'INSERT INTO outbox (recipient,subject,body,attachment,attachment_name,next_attempt,created_at) '
+        'VALUES (?,?,?,?,?,?,?)',
+        (recipient, subject, body, attachment, attachment_name,
+         time.time() + MAIL_BATCH_DELAY, datetime.datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+    get_sender().wake()
+    print(f"[MAIL] Queued message {cur.lastrowid} to {recipient}")
+    return cur.lastrowid
+
+
+def smtp_configured() -> bool:
+    return not SMTP_AUTH or bool(SMTP_USER and SMTP_PASSWORD)
+
+
+def pending_count() -> int:
+    conn = _connect()
+    count = conn.execute("SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending')").fetchone()[0]
+    conn.close()
+    return count
+
+
+class MailSender:
+    """Background thread that drains the outbox over a pooled SMTP connection."""
+
+    def __init__(self, poll_interval: float = 1.0):
+        self.poll_interval = poll_interval
+        self._smtp = None
+        self._last_used = 0.0
+        self._wake = threading.Event()
+        self._send_lock = threading.Lock()
+        self._thread = None
+        self._warned_unconfigured = False
+        self._owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name='mail-sender', daemon=True)
+            self._thread.start()
+            print(f"[MAIL] Sender started ({SMTP_HOST}:{SMTP_PORT})")
+
+    def wake(self):
+        self._wake.set()
+
+    def flush(self, force: bool = False) -> int:
+        """
+        Send every due message now (force=True ignores the batching delay and
+        retry backoff); returns the number of messages delivered.
+        """
+        with self._send_lock:
+            return self._send_due(force)
+
+    # ============================================
+    # SENDER LOOP
+    # ============================================
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                with self._send_lock:
+                    if self._smtp and time.time() - self._last_used > SMTP_IDLE_TIMEOUT:
+                        self._close()
+            except Exception as e:
+                print(f"[MAIL] Sender error: {e}")
+                traceback.print_exc()
+
+    def _claim(self, conn: sqlite3.Connection, force: bool):
+        """Atomically mark due rows as being sent by this sender; returns (claim id, claimed rows)."""
+        claim = f"{self._owner}:{uuid.uuid4().hex[:12]}"
+        now = time.time()
+        conn.isolation_level = None
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Claims of a sender that died mid-send expire after the lease
+            conn.execute("UPDATE outbox SET status = 'pending', claimed_by = NULL, claimed_at = NULL "
+                         "WHERE status = 'sending' AND claimed_at < ?", (now - MAIL_CLAIM_LEASE,))
+            conn.execute(
+                "UPDATE outbox SET status = 'sending', claimed_by = ?, claimed_at = ? WHERE id IN "
+                "(SELECT id FROM outbox WHERE status = 'pending'" + ("" if force else " AND next_attempt <= ?") + ")",
+                (claim, now) if force else (claim, now, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.isolation_level = ''
+        rows = conn.execute("SELECT * FROM outbox WHERE status = 'sending' AND claimed_by = ? ORDER BY id",
+                            (claim,)).fetchall()
+        return claim, rows
+
+    def _send_due(self, force: bool) -> int:
+        if not smtp_configured():
+            if not self._warned_unconfigured:
+                print("[MAIL] ⚠ SMTP_USER/SMTP_PASSWORD are not set; queued messages stay pending")
+                self._warned_unconfigured = True
+            return 0
+
+        conn = _connect()
+        claim, due = self._claim(conn, force)
+        if not due:
+            conn.close()
+            return 0
+
+        by_recipient: Dict[str, List[sqlite3.Row]] = {}
+        for row in due:
+            by_recipient.setdefault(row['recipient'], []).append(row)
+
+        delivered = 0
+        for recipient, rows in by_recipient.items():
+            ids = [(r['id'],) for r in rows]
+            try:
+                self._deliver(self._compose(recipient, rows))
+                conn.executemany("UPDATE outbox SET status = 'sent', sent_at = ?, attachment = NULL, claimed_by = NULL "
+                                 "WHERE id = ? AND claimed_by = ?",
+                                 [(datetime.datetime.now().isoformat(), i, claim) for (i,) in ids])
+                delivered += len(rows)
+                print(f"[MAIL] Sent {len(rows)} report(s) to {recipient}")
+            except Exception as e:
+                self._close()
+                attempts = max(r['attempts'] for r in rows) + 1
+                if attempts >= MAIL_MAX_ATTEMPTS:
+                    conn.executemany("UPDATE outbox SET status = 'failed', attempts = ?, last_error = ?, "
+                                     "claimed_by = NULL WHERE id = ? AND claimed_by = ?",
+                                     [(attempts, str(e), i, claim) for (i,) in ids])
+                    print(f"[MAIL] Giving up on {recipient} after {attempts} attempt(s): {e}")
+                else:
+                    retry_at = time.time() + MAIL_RETRY_BASE * 2 ** (attempts - 1)
+                    conn.executemany("UPDATE outbox SET status = 'pending', attempts = ?, next_attempt = ?, "
+                                     "last_error = ?, claimed_by = NULL WHERE id = ? AND claimed_by = ?",
+                                     [(attempts, retry_at, str(e), i, claim) for (i,) in ids])
+                    print(f"[MAIL] Send to {recipient} failed ({e}); retry {attempts} in "
+                          f"{retry_at - time.time():.0f}s")
+            conn.commit()
+        conn.close()
+        return delivered
+
+    @staticmethod
+    def _compose(recipient: str, rows: List[sqlite3.Row]) -> EmailMessage:
+        msg = EmailMessage()
+        msg['From'] = MAIL_FROM
+        msg['To'] = recipient
+        if len(rows) == 1:
+            msg['Subject'] = rows[0]['subject']
+            msg.set_content(rows[0]['body'])
+        else:
+            msg['Subject'] = f"SentinAI Analysis Reports ({len(rows)})"
+            msg.set_content(("\n" + "=" * 55 + "\n").join(f"{r['subject']}\n{r['body']}" for r in rows))
+        for r in rows:
+            # Messages queued without an attachment get their body rendered as the PDF report
+            data = bytes(r['attachment']) if r['attachment'] is not None else report_pdf(r['body'])
+            msg.add_attachment(data, maintype='application', subtype='pdf',
+                               filename=r['attachment_name'] or f"report-{r['id']}.pdf")
+        return msg
+
+    # ============================================
+    # SMTP CONNECTION
+    # ============================================
+
+    def _deliver(self, msg: EmailMessage):
+        smtp = self._connection()
+        smtp.send_message(msg)
+        self._last_used = time.time()
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close()
+        smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+        if SMTP_STARTTLS:
+            smtp.starttls()
+        if SMTP_AUTH:
+            smtp.login(SMTP_USER, SMTP_PASSWORD)
+        self._smtp = smtp
+        print(f"[MAIL] Connected to {SMTP_HOST}:{SMTP_PORT}")
+        return smtp
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_sender() -> MailSender:
+    """Process-wide sender; its thread starts on first use."""
+    global _sender
+    with _sender_lock:
+        if _sender is None:
+            _sender = MailSender()
+        _sender.start()
+        return _sender
@@ -0,0 +1,176 @@
+"""
+Process-wide registry for the heavy M2/M3 models.
+
+Models are registered once with a factory and built lazily on first use, so a
+worker pays GPT-2 / CLIP / HF pipeline load time once instead of per upload.
+Initialization is guarded per model so concurrent requests wait for the same
+load instead of racing to build duplicates. When the estimated parameter
+memory of all loaded models exceeds MODEL_MEMORY_BUDGET_MB, the least recently
+used models are evicted.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+print("[REGISTRY] Model registry initialized")
+
+# 0 disables eviction (keep everything loaded)
+MODEL_MEMORY_BUDGET_MB = int(os.environ.get("MODEL_MEMORY_BUDGET_MB", "0"))
+
+_factories: Dict[str, Callable[[], Any]] = {}
+_models: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_init_locks: Dict[str, threading.Lock] = {}
+_lock = threading.Lock()
+
+
+# ============================================
+# REGISTRATION
+# ============================================
+
+def register_model(name: str, factory: Callable[[], Any]) -> None:
+    """Register a zero-argument factory that builds the model called `name`."""
+    with _lock:
+        _factories[name] = factory
+        _init_locks.setdefault(name, threading.Lock())
+
+
+def registered_models() -> List[str]:
+    with _lock:
+        return list(_factories)
+
+
+# ============================================
+# LAZY, THREAD-SAFE ACCESS
+# ============================================
+
+def get_model(name: str) -> Any:
+    """
+    Return the shared instance of `name`, building it on first use.
+
+    Only one thread builds a given model; others block until it is ready.
+    """
+    with _lock:
+        entry = _models.get(name)
+        if entry is not None:
+            _models.move_to_end(name)
+            entry["last_used"] = time.time()
+            return entry["model"]
+        if name not in _factories:
+            raise KeyError(f"Unknown model: {name}")
+        factory = _factories[name]
+        init_lock = _init_locks[name]
+
+    with init_lock:
+        # Another thread may have finished loading while we waited
+        with _lock:
+            entry = _models.get(name)
+            if entry is not None:
+                _models.move_to_end(name)
+                entry["last_used"] = time.time()
+                return entry["model"]
+
+        print(f"[REGISTRY] Loading model: {name}")
+        started = time.time()
+        model = factory()
+        size = _estimate_bytes(model)
+        print(f"[REGISTRY] Loaded {name} in {time.time() - started:.1f}s (~{size / 2**20:.0f} MB)")
+
+        with _lock:
+            _models[name] = {"model": model, "bytes": size, "last_used": time.time()}
+            _evict_over_budget(keep=name)
+
+    return model
+
+
+def warm_up(names: Optional[Iterable[str]] = None) -> None:
+    """Load the given models (all registered ones by default) ahead of the first request."""
+    for name in (list(names) if names is not None else registered_models()):
+        try:
+            get_model(name)
+        except Exception as e:
+            print(f"[REGISTRY] Warm-up failed for {name}: {e}")
+
+
+def warm_up_async(names: Optional[Iterable[str]] = None) -> threading.Thread:
+    """Run warm_up() in a daemon thread so server startup is not blocked."""
+    thread = threading.Thread(target=warm_up, args=(names,), name="model-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+# ============================================
+# EVICTION
+# ============================================
+
+def evict(name: str) -> bool:
+    """Drop the shared instance of `name`; it is reloaded on next use."""
+    with _lock:
+        entry = _models.pop(name, None)
+    if entry is None:
+        return False
+    print(f"[REGISTRY] Evicted model: {name}")
+    _release_device_memory()
+    return True
+
+
+def loaded_models() -> Dict[str, int]:
+    """Map of loaded model name -> estimated bytes, least recently used first."""
+    with _lock:
+        return {name: entry["bytes"] for name, entry in _models.items()}
+
+
+def _evict_over_budget(keep: str) -> None:
+    # Caller holds _lock
+    if MODEL_MEMORY_BUDGET_MB <= 0:
+        return
+    budget = MODEL_MEMORY_BUDGET_MB * 2**20
+    evicted = False
+    while sum(e["bytes"] for e in _models.values()) > budget:
+        victim = next((n for n in _models if n != keep), None)
+        if victim is None:
+            break
+        _models.pop(victim)
+        evicted = True
+        print(f"[REGISTRY] Evicted model (memory budget): {victim}")
+    if evicted:
+        _release_device_memory()
+
+
+def _estimate_bytes(obj: Any) -> int:
+    """Sum parameter/buffer sizes of torch modules reachable from obj's attributes."""
+    seen = set()
+    total = 0
+
+    def visit(value, depth):
+        nonlocal total
+        if value is None or id(value) in seen or depth > 2:
+            return
+        seen.add(id(value))
+        if callable(getattr(value, "parameters", None)) and callable(getattr(value, "buffers", None)):
+            try:
+                total += sum(p.numel() * p.element_size() for p in value.parameters())
+                total += sum(b.numel() * b.element_size() for b in value.buffers())
+            except Exception:
+                pass
+            return
+        # HF pipelines keep their torch module on `.model`
+        if hasattr(value, "__dict__"):
+            for attr in vars(value).values():
+                visit(attr, depth + 1)
+
+    visit(obj, 0)
+    return total
+
+
+def _release_device_memory() -> None:
+    import gc
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except Exception:
+        pass
@@ -7,32 +7,75 @@ import os
 import sys
 import json
 import traceback
-from typing import Tuple, Dict, Any
+from typing import Tuple, Dict, Any, List
 import tempfile
 import shutil
 
+from model_registry import register_model, get_model
+import result_cache
+from result_cache import file_sha256
+
 print("[WRAPPER] Module wrapper initialized")
 
+
+# ============================================
+# SHARED MODELS (loaded once per worker)
+# ============================================
+
+def _build_m2_verifier():
+    from M2 import DocumentAuthenticityVerifier
+    return DocumentAuthenticityVerifier()
+
+
+def _build_m3_detector():
+    from M3 import SentinAIDetector
+    return SentinAIDetector()
+
+
+M2_VERIFIER = "m2_verifier"
+M3_DETECTOR = "m3_detector"
+
+register_model(M2_VERIFIER, _build_m2_verifier)
+register_model(M3_DETECTOR, _build_m3_detector)
+
+# Result cache versions: bump one when the code or model behind that cached value changes
+M1_TEXT_CACHE_VERSION = "m1-clean-v1"
+M2_TEXT_CACHE_VERSION = "m2-text-v1"
+M2_RESULT_CACHE_VERSION = "gpt2-w512-s400-v1"
+# Forensic sub-scores differ slightly when JPEGs are decoded in draft mode (see M3.load_image),
+# and which scorers the cascade skips (stored as None) depends on its mode
+M3_SCORES_CACHE_VERSION = "clip-vit-b32+ai-image-detector-v2" + (
+    "+draft512" if os.environ.get("SENTINAI_JPEG_DRAFT", "1") == "1" else "") + (
+    "+cascade-" + os.environ.get("SENTINAI_CASCADE", "safe"))
+
+# Directory for M1's structured NDJSON results (unset = don't write them)
+M1_RESULTS_DIR = os.environ.get('M1_RESULTS_DIR')
+
+
 # ============================================
 # MODULE 1: DOCUMENT GROUPING & DUPLICATE CHECK
 # ============================================
 
-def analyze_document_m1(filepaths: list) -> Tuple[str, int, str]:
+def analyze_document_m1(filepaths: list, result_path: str = None) -> Tuple[str, int, str]:
     """
     Analyze multiple documents for grouping/duplicate detection.
     M1 compares documents together to find duplicates.
     
     Args:
         filepaths: List of file paths to analyze together
+        result_path: Optional NDJSON file for the structured result (groups, pair
+            scores, document features, conflict flags). Defaults to a new file
+            in M1_RESULTS_DIR when that is set.
     
     Returns: (label, score, message)
-    - label: "UNIQUE" or "DUPLICATE_GROUP" or "HAS_DUPLICATES"
+    - label: "UNIQUE", "ALL_UNIQUE", "ALL_DUPLICATE", "HAS_DUPLICATES" or "PREVIOUSLY_SUBMITTED"
     - score: 0-100 (duplicate count / total count * 100)
     - message: detailed report
     """
     try:
         print(f"[M1] Starting analysis on {len(filepaths)} document(s)")
-        from M1 import read_file, clean_text, build_similarity, group_documents, generate_report
+        from M1 import build_similarity, group_documents, AnalysisResult
+        from ingest import ingest_files
         
         # Validate inputs
         if not filepaths or len(filepaths) == 0:
@@ -42,39 +85,74 @@ def analyze_document_m1(filepaths: list) -> Tuple[str, int, str]:
         
         print(f"[M1] Reading {len(filepaths)} files...")
         
-        # Read and clean all documents
-        cleaned_docs = {}
+        # Cleaned text comes from the result cache or the parallel ingestion pool
+        texts, shas, unreadable = {}, {}, []
         for filepath in filepaths:
             try:
-                content = read_file(filepath)
-                if content and len(content.strip()) > 30:
-                    filename = os.path.basename(filepath)
-                    cleaned_docs[filename] = clean_text(content)
-                    print(f"[M1] ✓ Loaded: {filename}")
-            except Exception as e:
-                print(f"[M1] ⚠ Skipped {os.path.basename(filepath)}: {e}")
-        
-        if len(cleaned_docs) < 2:
-            # Only one valid file - mark as unique
-            print(f"[M1] Only 1 valid document found")
-            msg = "Only 1 document analyzed - marked as UNIQUE (need 2+ docs for comparison)"
+                shas[filepath] = file_sha256(filepath)
+            except OSError as e:
+                unreadable.append(f"{os.path.basename(filepath)} ({e})")
+                continue
+            cached = result_cache.get('m1_text', shas[filepath], M1_TEXT_CACHE_VERSION)
+            if cached is not None:
+                texts[filepath] = cached
+        
+        pending = [p for p in shas if p not in texts]
+        for filepath, text, error in ingest_files(pending):
+            if error:
+                print(f"[M1] ⚠ Could not read {os.path.basename(filepath)}: {error}")
+                unreadable.append(f"{os.path.basename(filepath)} ({error})")
+            else:
+                texts[filepath] = text
+                result_cache.put('m1_text', shas[filepath], M1_TEXT_CACHE_VERSION, text)
+        
+        cleaned_docs = {}
+        for filepath in filepaths:
+            text = texts.get(filepath)
+            if text and len(text) > 30:
+                filename = os.path.basename(filepath)
+                cleaned_docs[filename] = text
+                print(f"[M1] ✓ Loaded: {filename}")
+        
+        if not cleaned_docs:
+            if unreadable:
+                msg = f"No readable documents. Could not read: {', '.join(unreadable)}"
+                print(f"[M1] {msg}")
+                return "ERROR", 0, msg
+            print(f"[M1] No valid documents found")
+            msg = "No readable documents - marked as UNIQUE (need 2+ docs for comparison)"
             return "UNIQUE", 100, msg
         
-        print(f"[M1] Building similarity matrix for {len(cleaned_docs)} documents...")
+        print(f"[M1] Building similarity graph for {len(cleaned_docs)} documents...")
         
-        # Build similarity matrix and group
-        files, sim_matrix = build_similarity(cleaned_docs)
-        groups = group_documents(files, sim_matrix, threshold=0.75)
+        # Build sparse similarity graph (pairs >= threshold only) and group
+        files, sim_graph, vectors = build_similarity(cleaned_docs, threshold=0.75)
+        groups = group_documents(files, sim_graph, threshold=0.75, vectors=vectors)
         
         print(f"[M1] Found {len(groups)} document group(s)")
         
-        # Generate report
-        report_text = generate_report(groups, cleaned_docs, sim_matrix, files)
+        # Compare against every earlier submission, then record this batch
+        history = match_document_history(files, cleaned_docs, vectors, threshold=0.75)
+        previous = [doc for doc in files if history.get(doc)]
+        
+        # Structured result for downstream consumers
+        if result_path or M1_RESULTS_DIR:
+            write_m1_result(AnalysisResult.build(groups, cleaned_docs, files, vectors, history), result_path)
         
         # Analyze groups to determine result
         duplicate_groups = [g for g in groups if len(g) > 1]
         
-        if len(duplicate_groups) == 0:
+        if len(duplicate_groups) == 0 and previous:
+            label = "PREVIOUSLY_SUBMITTED"
+            score = max(5, 100 - int(len(previous) / len(files) * 100))
+            message = f"⚠ {len(previous)} of {len(files)} document(s) match earlier submissions"
+        elif len(cleaned_docs) < 2:
+            # Only one valid file and nothing similar in history - mark as unique
+            print(f"[M1] Only 1 valid document found")
+            label = "UNIQUE"
+            score = 100
+            message = "Only 1 document analyzed - marked as UNIQUE (no earlier submission matches it)"
+        elif len(duplicate_groups) == 0:
             label = "ALL_UNIQUE"
             score = 100
             message = f"✓ All {len(cleaned_docs)} documents are UNIQUE. No duplicates detected."
@@ -88,6 +166,11 @@ def analyze_document_m1(filepaths: list) -> Tuple[str, int, str]:
             label = "HAS_DUPLICATES"
             message = f"Found {len(duplicate_groups)} group(s) with {dup_count} duplicate document(s). Total analyzed: {len(cleaned_docs)}"
         
+        if duplicate_groups and previous:
+            message += f". {len(previous)} document(s) also match earlier submissions."
+        if unreadable:
+            message = message.rstrip(".") + f". Could not read {len(unreadable)} file(s): {', '.join(unreadable)}"
+        
         print(f"[M1] Result: {label} (score: {score})")
         print(f"[M1] Message: {message}")
         return label, score, message
@@ -99,6 +182,50 @@ def analyze_document_m1(filepaths: list) -> Tuple[str, int, str]:
         return "ERROR", 0, msg
 
 
+def write_m1_result(result, result_path: str = None) -> str:
+    """Write an M1 AnalysisResult as NDJSON; returns the path written."""
+    if not result_path:
+        import uuid
+        import datetime
+        os.makedirs(M1_RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        result_path = os.path.join(M1_RESULTS_DIR, f"m1-{stamp}-{uuid.uuid4().hex[:8]}.ndjson")
+    with open(result_path, 'w', encoding='utf-8') as f:
+        for line in result.iter_ndjson():
+            f.write(line)
+    print(f"[M1] Structured result written to {result_path}")
+    return result_path
+
+
+def match_document_history(files: list, cleaned_docs: dict, vectors, threshold: float = 0.75) -> Dict[str, list]:
+    """
+    Look up each document in the persistent document index, then append the batch to it.
+    
+    Returns: {filename: [(metadata, score), ...]} for documents matching earlier submissions.
+    History problems never fail the analysis; they only disable the check.
+    """
+    try:
+        from doc_index import get_document_index, text_sha256
+        from M1 import is_minhash, vectorize
+        
+        # The history index stores hashing vectors whichever backend grouped the batch
+        if is_minhash(vectors):
+            vectors = vectorize({f: cleaned_docs[f] for f in files})[1]
+        
+        index = get_document_index(vectors.shape[1])
+        shas = [text_sha256(cleaned_docs[f]) for f in files]
+        matches = index.query(vectors, shas, threshold=threshold)
+        index.add(files, vectors, shas)
+        
+        history = {f: m for f, m in zip(files, matches) if m}
+        print(f"[M1] History: {len(history)} of {len(files)} document(s) seen before ({len(index)} indexed)")
+        return history
+    except Exception as e:
+        print(f"[M1] ⚠ Document history unavailable: {e}")
+        traceback.print_exc()
+        return {}
+
+
 # ============================================
 # MODULE 2: AI vs HUMAN TEXT DETECTION
 # ============================================
@@ -115,35 +242,48 @@ def analyze_text_m2(filepath: str) -> Tuple[str, int, str]:
     try:
         print(f"[M2] Starting analysis on {filepath}")
         from M2 import (
-            DocumentAuthenticityVerifier,
             extract_text_from_txt,
             extract_text_from_docx,
-            extract_pdf_text
+            extract_pdf_text,
+            VERIFY_CHAR_BUDGET
         )
         
-        # Extract text based on file type
         ext = os.path.splitext(filepath)[1].lower()
-        
-        if ext == '.txt':
-            text = extract_text_from_txt(filepath)
-        elif ext == '.pdf':
-            text, _ = extract_pdf_text(filepath)
-        elif ext == '.docx':
-            text = extract_text_from_docx(filepath)
-        else:
+        if ext not in ('.txt', '.pdf', '.docx'):
             msg = f"Unsupported file type: {ext}"
             print(f"[M2] {msg}")
             return "ERROR", 0, msg
         
-        if not text or len(text.strip()) < 30:
-            msg = "Insufficient text in file for analysis"
-            print(f"[M2] {msg}")
-            return "ERROR", 0, msg
+        sha = file_sha256(filepath)
+        # A character budget changes the text the verdict is based on
+        budget_tag = f"-b{VERIFY_CHAR_BUDGET}" if VERIFY_CHAR_BUDGET else ""
+        text_version = M2_TEXT_CACHE_VERSION + budget_tag
+        result_version = M2_RESULT_CACHE_VERSION + budget_tag
+        cached = result_cache.get('m2', sha, result_version)
         
-        # Run verification
-        print(f"[M2] Initializing verifier...")
-        verifier = DocumentAuthenticityVerifier()
-        verdict, confidence = verifier.verify(text)
+        if cached:
+            verdict, confidence = cached
+        else:
+            # Extract text based on file type
+            text = result_cache.get('m2_text', sha, text_version)
+            if text is None:
+                if ext == '.txt':
+                    text = extract_text_from_txt(filepath)
+                elif ext == '.pdf':
+                    text, _ = extract_pdf_text(filepath)
+                else:
+                    text = extract_text_from_docx(filepath)
+                result_cache.put('m2_text', sha, text_version, text)
+            
+            if not text or len(text.strip()) < 30:
+                msg = "Insufficient text in file for analysis"
+                print(f"[M2] {msg}")
+                return "ERROR", 0, msg
+            
+            # Run verification
+            verifier = get_model(M2_VERIFIER)
+            verdict, confidence = verifier.verify(text)
+            result_cache.put('m2', sha, result_version, [verdict, confidence])
         
         # Parse confidence
         try:
@@ -178,7 +318,6 @@ def analyze_image_m3(filepath: str) -> Tuple[str, int, str]:
     """
     try:
         print(f"[M3] Starting analysis on {filepath}")
-        from M3 import SentinAIDetector
         
         # Check if image exists
         if not os.path.exists(filepath):
@@ -186,19 +325,24 @@ def analyze_image_m3(filepath: str) -> Tuple[str, int, str]:
             print(f"[M3] {msg}")
             return "ERROR", 0, msg
         
-        # Initialize detector
-        print(f"[M3] Initializing SentinAI detector...")
-        detector = SentinAIDetector()
+        sha = file_sha256(filepath)
+        result = _cached_m3_result(filepath, sha)
         
-        # Analyze image
-        print(f"[M3] Running analysis...")
-        result = detector.analyze(filepath)
+        if result is None:
+            detector = get_model(M3_DETECTOR)
+            
+            # Analyze image
+            print(f"[M3] Running analysis...")
+            result = detector.analyze(filepath)
+            result_cache.put('m3', sha, M3_SCORES_CACHE_VERSION, result['scores'])
         
         label = result['category']
         score = int(result['confidence_percent'])
-        message = f"Analysis complete: {label} with {score}% confidence"
+        message = _m3_message(result)
         
         print(f"[M3] Result: {label} (confidence: {score}%)")
+        if result.get('stages'):
+            print(f"[M3] Stages run: {', '.join(result['stages'])} (early exit: {result.get('early_exit')})")
         return label, score, message
     
     except Exception as e:
@@ -208,94 +352,104 @@ def analyze_image_m3(filepath: str) -> Tuple[str, int, str]:
         return "ERROR", 0, msg
 
 
+def analyze_images_m3(filepaths: list, progress=None) -> List[Tuple[str, int, str]]:
+    """
+    Run M3 over several images at once, batching the CLIP and classifier passes.
+    
+    Args:
+        filepaths: Image paths to analyze
+        progress: Optional callback(done, total) invoked after each micro-batch
+    
+    Returns: one (label, score, message) tuple per file, in input order
+    """
+    try:
+        print(f"[M3] Starting batch analysis on {len(filepaths)} image(s)")
+        
+        shas = {p: file_sha256(p) for p in filepaths if os.path.exists(p)}
+        known = {p: r for p, r in ((p, _cached_m3_result(p, sha)) for p, sha in shas.items()) if r}
+        
+        # Only images never seen before go through the models
+        pending = [p for p in shas if p not in known]
+        if pending:
+            detector = get_model(M3_DETECTOR)
+            for path, result in zip(pending, detector.analyze_batch(pending, progress=progress)):
+                known[path] = result
+                if result['category'] != "ERROR":
+                    result_cache.put('m3', shas[path], M3_SCORES_CACHE_VERSION, result['scores'])
+        elif progress:
+            progress(len(filepaths), len(filepaths))
+        
+        results = []
+        for filepath in filepaths:
+            if filepath not in known:
+                results.append(("ERROR", 0, "Image file not found"))
+                continue
+            result = known[filepath]
+            label = result['category']
+            if label == "ERROR":
+                results.append(("ERROR", 0, f"M3 Error: {result.get('error', 'unreadable image')}"))
+                continue
+            score = int(result['confidence_percent'])
+            results.append((label, score, _m3_message(result)))
+            print(f"[M3] {os.path.basename(filepath)}: {label} (confidence: {score}%)")
+        return results
+    
+    except Exception as e:
+        msg = f"M3 Error: {str(e)}"
+        print(f"[M3] {msg}")
+        traceback.print_exc()
+        return [("ERROR", 0, msg)] * len(filepaths)
+
+
+def _m3_message(result: Dict[str, Any]) -> str:
+    message = f"Analysis complete: {result['category']} with {int(result['confidence_percent'])}% confidence"
+    if result.get('duplicate_of'):
+        message += f" (same image as earlier upload {result['duplicate_of']['filename']}; verdict reused)"
+    elif result.get('near_duplicates'):
+        names = ", ".join(m['filename'] for m in result['near_duplicates'][:3])
+        message += f" (near-duplicate of earlier upload(s): {names})"
+    return message
+
+
+def _cached_m3_result(filepath: str, sha: str):
+    """Re-decide an image from cached sub-scores (semantic/local/forensic/exif) without loading models."""
+    scores = result_cache.get('m3', sha, M3_SCORES_CACHE_VERSION)
+    if not scores:
+        return None
+    from M3 import SentinAIDetector
+    return SentinAIDetector.decide(filepath, **scores)
+
+
 # ============================================
 # EMAIL FUNCTIONALITY
 # ============================================
 
 def send_report_email(recipient_email: str, subject: str, body: str, report_file: str = None) -> bool:
     """
-    Send analysis report to user's email.
+    Queue an analysis report for the user's email (see mailer.py).
+    
+    The background sender delivers it, batched with other reports for the same
+    recipient and retried on failure, so callers never wait on SMTP.
     
     Args:
         recipient_email: User's email
         subject: Email subject
         body: Email body text
-        report_file: Optional PDF attachment path
+        report_file: Optional PDF attachment path; without one a PDF is rendered from the body
     
     Returns:
-        True if sent successfully, False otherwise
+        True if queued successfully, False otherwise
     """
     try:
-        print(f"[EMAIL] Preparing email to {recipient_email}")
-        import smtplib
-        from email.mime.text import MIMEText
-        from email.mime.multipart import MIMEMultipart
-        from email.mime.base import MIMEBase
-        from email import encoders
-        
-        # Gmail credentials (app-specific password)
-        sender_email = "scriptsculptor9@gmail.com"
-        sender_password = "rtma cpxc wdfg xfym"  # App-specific password
-        
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = recipient_email
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body, 'plain'))
-        
-        # If no report_file provided, generate a simple PDF from the body so
-        # emails always include a PDF attachment (PDF-only reports).
-        temp_pdf = None
-        if not report_file:
-            try:
-                from fpdf import FPDF
-                import tempfile
-                pdf = FPDF()
-                pdf.add_page()
-                pdf.set_auto_page_break(auto=True, margin=15)
-                pdf.set_font("Arial", size=12)
-                for line in body.splitlines():
-                    pdf.multi_cell(0, 8, line)
-
-                tf = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-                temp_pdf = tf.name
-                tf.close()
-                pdf.output(temp_pdf)
-                report_file = temp_pdf
-                print(f"[EMAIL] Generated temporary PDF report: {report_file}")
-            except Exception as e:
-                print(f"[EMAIL] Warning: PDF generation failed: {e}")
-
-        # Attach report if provided (either original or generated)
+        import mailer
+        
+        attachment, name = None, None
         if report_file and os.path.exists(report_file):
-            try:
-                with open(report_file, 'rb') as attachment:
-                    part = MIMEBase('application', 'octet-stream')
-                    part.set_payload(attachment.read())
-                encoders.encode_base64(part)
-                part.add_header('Content-Disposition', f'attachment; filename= {os.path.basename(report_file)}')
-                msg.attach(part)
-                print(f"[EMAIL] Attached file: {report_file}")
-            except Exception as e:
-                print(f"[EMAIL] Warning: Could not attach file: {e}")
-        
-        # Send email
-        print(f"[EMAIL] Connecting to Gmail SMTP...")
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.send_message(msg)
-        server.quit()
-        
-        print(f"[EMAIL] Successfully sent to {recipient_email}")
-        # Cleanup temporary PDF if we created one
-        try:
-            if temp_pdf and os.path.exists(temp_pdf):
-                os.remove(temp_pdf)
-                print(f"[EMAIL] Removed temporary PDF: {temp_pdf}")
-        except Exception:
-            pass
+            with open(report_file, 'rb') as f:
+                attachment = f.read()
+            name = os.path.basename(report_file)
+        
+        mailer.enqueue(recipient_email, subject, body, attachment, name)
         return True
     
     except Exception as e:
@@ -326,7 +480,7 @@ def analyze_file(filepath: str, module: str) -> Tuple[str, int, str]:
     print(f"[ROUTER] Analyzing {filepath} with module={module}")
     
     if module == 'duplicate':
-        return analyze_document_m1(filepath)
+        return analyze_document_m1([filepath])
     elif module == 'text':
         return analyze_text_m2(filepath)
     elif module == 'image':
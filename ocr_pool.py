@@ -0,0 +1,23 @@
+"""
+Page-level OCR worker used by M2's OCR process pool.
+
+Kept free of torch/transformers imports so that worker processes, which are
+started with "forkserver" (or "spawn" where that is unavailable), come up
+quickly.
+"""
+
+import time
+import pytesseract
+from pdf2image import convert_from_path
+
+
+def ocr_page(path, page_no, dpi, poppler_path, tesseract_cmd):
+    """Render one PDF page and OCR it; returns (page_no, text, seconds)."""
+    started = time.perf_counter()
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    images = convert_from_path(path, dpi=dpi, first_page=page_no, last_page=page_no, poppler_path=poppler_path)
+    text = ""
+    for img in images:
+        text += pytesseract.image_to_string(img)
+        img.close()
+    return page_no, text, time.perf_counter() - started
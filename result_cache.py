@@ -0,0 +1,140 @@
+"""
+Content-addressed cache for extracted text and model results.
+
+Entries are keyed by the SHA-256 of the uploaded file's bytes plus a version
+string for the model/config that produced them, so re-uploads of the same
+file skip extraction, OCR and model inference. Values are JSON blobs in a
+small SQLite database; when the total stored size exceeds RESULT_CACHE_MAX_MB
+the least recently used entries are evicted.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH', os.path.join(BASE_DIR, 'result_cache.db'))
+RESULT_CACHE_MAX_MB = int(os.environ.get('RESULT_CACHE_MAX_MB', '256'))
+# Set RESULT_CACHE_DISABLED=1 to always recompute
+RESULT_CACHE_DISABLED = os.environ.get('RESULT_CACHE_DISABLED', '') == '1'
+
+_initialized = False
+
+# Hashes already computed elsewhere (e.g. while an upload was written), keyed by
+# (path, size, mtime) so a modified file is hashed again
+_known_hashes = OrderedDict()
+_known_lock = threading.Lock()
+_KNOWN_MAX = 4096
+
+
+def _stat_key(path: str):
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+
+def register_sha256(path: str, sha: str) -> None:
+    """Record the SHA-256 of a file so file_sha256() does not have to read it again."""
+    key = _stat_key(path)
+    with _known_lock:
+        _known_hashes[key] = sha
+        _known_hashes.move_to_end(key)
+        while len(_known_hashes) > _KNOWN_MAX:
+            _known_hashes.popitem(last=False)
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    key = _stat_key(path)
+    with _known_lock:
+        if key in _known_hashes:
+            return _known_hashes[key]
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _connect():
+    global _initialized
+    conn = sqlite3.connect(RESULT_CACHE_PATH, timeout=30)
+    if not _initialized:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY,
+            kind TEXT,
+            value TEXT,
+            size INTEGER,
+            last_used REAL
+        )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_last_used ON cache(last_used)')
+        conn.commit()
+        _initialized = True
+    return conn
+
+
+def _key(kind: str, sha: str, version: str) -> str:
+    return f"{kind}:{version}:{sha}"
+
+
+def get(kind: str, sha: str, version: str) -> Optional[Any]:
+    """Cached value for (kind, file hash, version), or None."""
+    if RESULT_CACHE_DISABLED or not sha:
+        return None
+    try:
+        conn = _connect()
+        key = _key(kind, sha, version)
+        row = conn.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+        if row:
+            conn.execute('UPDATE cache SET last_used = ? WHERE key = ?', (time.time(), key))
+            conn.commit()
+        conn.close()
+    except sqlite3.Error as e:
+        print(f"[CACHE] Read failed: {e}")
+        return None
+    if not row:
+        return None
+    print(f"[CACHE] Hit {kind} {sha[:12]}")
+    return json.loads(row[0])
+
+
+def put(kind: str, sha: str, version: str, value: Any) -> None:
+    if RESULT_CACHE_DISABLED or not sha:
+        return
+    blob = json.dumps(value)
+    try:
+        conn = _connect()
+        conn.execute('INSERT OR REPLACE INTO cache (key,kind,value,size,last_used) VALUES (?,?,?,?,?)',
+                     (_key(kind, sha, version), kind, blob, len(blob), time.time()))
+        _evict(conn)
+        conn.commit()
+        conn.close()
+    except sqlite3.Error as e:
+        print(f"[CACHE] Write failed: {e}")
+
+
+def _evict(conn) -> None:
+    budget = RESULT_CACHE_MAX_MB * 2**20
+    total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+    if total <= budget:
+        return
+    freed, victims = 0, []
+    for key, size in conn.execute('SELECT key, size FROM cache ORDER BY last_used'):
+        victims.append((key,))
+        freed += size
+        if total - freed <= budget:
+            break
+    conn.executemany('DELETE FROM cache WHERE key = ?', victims)
+    print(f"[CACHE] Evicted {len(victims)} entr(ies), {freed / 2**20:.1f} MB")
+
+
+def clear() -> None:
+    conn = _connect()
+    conn.execute('DELETE FROM cache')
+    conn.commit()
+    conn.close()
@@ -1,4 +1,38 @@
 console.log('main.js loaded');
+
+// Poll /jobs/<id> until the job leaves the queued/running states.
+// Gives up (throws) after JOB_POLL_TIMEOUT_MS, or after JOB_POLL_MAX_FAILURES
+// failed polls in a row (network error or non-OK response)
+const JOB_POLL_MS = 1500;
+const JOB_POLL_TIMEOUT_MS = 10 * 60 * 1000;
+const JOB_POLL_MAX_FAILURES = 5;
+async function pollJob(url, onProgress){
+  const deadline = Date.now() + JOB_POLL_TIMEOUT_MS;
+  let failures = 0;
+  while(true){
+    try{
+      const res = await fetch(url);
+      if(!res.ok){ throw new Error(`Server returned ${res.status}`); }
+      const job = await res.json();
+      failures = 0;
+      if(job.status !== 'queued' && job.status !== 'running'){
+        return job;
+      }
+      if(onProgress){ onProgress(job); }
+    }catch(err){
+      failures += 1;
+      console.warn(`Job poll failed (${failures}/${JOB_POLL_MAX_FAILURES}):`, err);
+      if(failures >= JOB_POLL_MAX_FAILURES){
+        throw new Error(`Lost contact with the server while waiting for the analysis (${err.message})`);
+      }
+    }
+    if(Date.now() >= deadline){
+      throw new Error(`Analysis did not finish within ${JOB_POLL_TIMEOUT_MS / 60000} minutes`);
+    }
+    await new Promise(r => setTimeout(r, JOB_POLL_MS));
+  }
+}
+
 document.addEventListener('DOMContentLoaded', ()=>{
   console.log('DOMContentLoaded - attaching upload-form listeners');
   // upload forms with real-time feedback
@@ -76,12 +110,40 @@ document.addEventListener('DOMContentLoaded', ()=>{
         }
         
         const res = await fetch(`/upload/${module}`, { method:'POST', body: fd });
-        const j = await res.json();
+        let j = await res.json();
         
         console.log('Response:', j);
         
+        // Upload returns a job id right away; poll it until the analysis finishes
+        if(j.job_id){
+          try{
+            j = await pollJob(j.poll_url || `/jobs/${j.job_id}`, (job)=>{
+              const pb = overlay.querySelector('.progress-bar');
+              if(pb){ pb.style.width = `${job.progress || 10}%`; pb.textContent = `${job.progress || 0}%`; }
+              if(job.note){ overlay.querySelector('.processing-desc').textContent = `Module: ${module.toUpperCase()} — ${job.note}`; }
+            });
+          }catch(err){
+            console.error('Job polling stopped:', err);
+            if(resultEl){
+              resultEl.innerHTML = `
+                <div class="alert alert-danger fade-in">
+                  <strong>❌ Analysis Not Completed</strong>
+                  <br>${err.message}
+                  <br><small>The job may still finish in the background; try again later.</small>
+                </div>
+              `;
+            }
+            // show the error on the overlay, then hide it
+            overlay.querySelector('.processing-spinner').textContent = '❌';
+            overlay.querySelector('.processing-desc').textContent = err.message;
+            const pb = overlay.querySelector('.progress-bar'); if(pb){ pb.textContent = 'Stopped'; }
+            setTimeout(()=>{ overlay.classList.remove('show'); overlay.querySelector('.processing-spinner').textContent = '⏳'; }, 3000);
+            return;
+          }
+          console.log('Job finished:', j);
+        }
+        
         // Update overlay progress to 90%
-        const overlay = document.querySelector('.processing-overlay');
         if(overlay){
           const pb = overlay.querySelector('.progress-bar');
           if(pb){ pb.style.width = '90%'; pb.textContent = j.score ? `${j.score}%` : 'Finalizing...'; }
@@ -0,0 +1,115 @@
+"""
+Shared text extraction for M1 and M2.
+
+iter_text() yields a document's text segment by segment (PDF pages, DOCX
+paragraphs, TXT chunks) and stops as soon as an optional character budget is
+reached, so callers that only need the start of a document never parse the
+rest. Time spent per format is accumulated in extraction_stats().
+"""
+
+import os
+import time
+import threading
+from typing import Dict, Iterator, Optional
+
+from docx import Document
+from PyPDF2 import PdfReader
+
+SUPPORTED_EXTENSIONS = (".txt", ".pdf", ".docx")
+TXT_CHUNK_CHARS = 1 << 16
+
+_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+
+class UnsupportedFormat(ValueError):
+    pass
+
+
+# ============================================
+# PER-FORMAT SEGMENT READERS
+# ============================================
+
+def _iter_txt(path: str) -> Iterator[str]:
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for chunk in iter(lambda: f.read(TXT_CHUNK_CHARS), ""):
+            yield chunk
+
+
+def _iter_docx(path: str) -> Iterator[str]:
+    for p in Document(path).paragraphs:
+        yield p.text
+
+
+def iter_pdf_pages(path: str) -> Iterator[str]:
+    """Embedded text of each page, in order ('' for pages whose text cannot be read)."""
+    for page_no, page in enumerate(PdfReader(path).pages, 1):
+        try:
+            yield page.extract_text() or ""
+        except Exception as e:
+            print(f"[EXTRACT] ⚠ {os.path.basename(path)} page {page_no}: {e}")
+            yield ""
+
+
+# ============================================
+# STREAMING API
+# ============================================
+
+def iter_text(path: str, budget: Optional[int] = None) -> Iterator[str]:
+    """
+    Yield the text of `path` segment by segment. Pages and paragraphs are
+    separated by newlines, so "".join() of the segments is the full text.
+    Stops after `budget` characters when a budget is given.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".txt":
+        segments, sep = _iter_txt(path), ""
+    elif ext == ".pdf":
+        segments, sep = iter_pdf_pages(path), "\n"
+    elif ext == ".docx":
+        segments, sep = _iter_docx(path), "\n"
+    else:
+        raise UnsupportedFormat(f"Unsupported file type: {ext}")
+
+    count, produced, elapsed = 0, 0, 0.0
+    started = time.perf_counter()
+    try:
+        for seg in segments:
+            if count:
+                seg = sep + seg
+            count += 1
+            done = budget is not None and produced + len(seg) >= budget
+            if done:
+                seg = seg[:budget - produced]
+            produced += len(seg)
+            elapsed += time.perf_counter() - started
+            yield seg
+            if done:
+                return
+            started = time.perf_counter()
+    finally:
+        record_timing(ext.lstrip("."), count, produced, elapsed)
+
+
+def read_text(path: str, budget: Optional[int] = None) -> str:
+    """Full text of `path` (or its first `budget` characters)."""
+    return "".join(iter_text(path, budget))
+
+
+# ============================================
+# TIMING COUNTERS
+# ============================================
+
+def record_timing(fmt: str, segments: int, chars: int, seconds: float) -> None:
+    with _stats_lock:
+        s = _stats.setdefault(fmt, {"files": 0, "segments": 0, "chars": 0, "seconds": 0.0})
+        s["files"] += 1
+        s["segments"] += segments
+        s["chars"] += chars
+        s["seconds"] += seconds
+
+
+def extraction_stats() -> Dict[str, Dict[str, float]]:
+    """Snapshot of per-format counters: files, segments, chars and seconds spent extracting."""
+    with _stats_lock:
+        return {fmt: dict(s) for fmt, s in _stats.items()}
@@ -5,6 +5,7 @@ Update EMAIL and PASSWORD to an account that exists in the app, and FILES paths.
 import requests
 import os
 import sys
+import time
 
 BASE = "http://127.0.0.1:5000"
 EMAIL = "test@example.com"  # replace
@@ -39,6 +40,15 @@ print('Uploading files:', [f[1][0] for f in files])
 resp = s.post(f"{BASE}/upload/duplicate", files=files)
 print('Upload status code:', resp.status_code)
 try:
-    print('Response JSON:', resp.json())
+    job = resp.json()
+    print('Response JSON:', job)
 except Exception:
     print('Response text:', resp.text)
+    sys.exit(1)
+
+# Uploads are processed in the background; poll the job until it finishes
+while job.get('status') in ('queued', 'running'):
+    time.sleep(1.5)
+    job = s.get(f"{BASE}/jobs/{job['job_id']}").json()
+    print(f"Job {job.get('status')}: {job.get('progress')}% {job.get('note') or ''}")
+print('Final result:', job)
@@ -0,0 +1,121 @@
+"""
+Content-addressed storage for uploaded files.
+
+UploadRequest makes Werkzeug's form parser write each uploaded file straight
+into a HashingSpool in the store's tmp directory, so the SHA-256 and size are
+known as soon as the request body has been read and the bytes are written to
+disk exactly once. BlobStore.commit() then moves the spool to
+blobs/<sha[:2]>/<sha> (or drops it when that blob already exists) and the
+upload is exposed under its original name via a hard link.
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+from typing import List, Optional, Tuple
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Largest single file accepted (MAX_FILE_MB, 0 = only the request limit applies)
+MAX_FILE_MB = int(os.environ.get('MAX_FILE_MB', '50'))
+
+
+class HashingSpool:
+    """Writable temp file that hashes and counts bytes as they are written."""
+
+    def __init__(self, tmp_dir: str, max_bytes: int = 0):
+        fd, self.path = tempfile.mkstemp(dir=tmp_dir, suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.committed = False
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f'File exceeds the {self.max_bytes // 2**20} MB limit')
+        self._hash.update(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def finish(self):
+        self._file.flush()
+        self._file.close()
+
+    def discard(self):
+        self._file.close()
+        if not self.committed and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        # read/seek/tell/flush/close... go to the underlying file
+        return getattr(self._file, name)
+
+
+class BlobStore:
+    """Deduplicated blob directory plus per-upload hard links with the original file names."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def blob_path(self, sha: str) -> str:
+        return os.path.join(self.root, 'blobs', sha[:2], sha)
+
+    def spool(self, max_bytes: int = 0) -> HashingSpool:
+        return HashingSpool(self.tmp_dir, max_bytes)
+
+    def commit(self, spool: HashingSpool) -> Tuple[str, bool]:
+        """Move a finished spool into the store; returns (blob path, already stored)."""
+        spool.finish()
+        path = self.blob_path(spool.sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(spool.path)
+            existed = True
+        else:
+            os.replace(spool.path, path)
+            existed = False
+        spool.committed = True
+        return path, existed
+
+    @staticmethod
+    def link(blob: str, dest: str) -> str:
+        """Expose a blob at dest without copying where the filesystem allows it."""
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        try:
+            os.link(blob, dest)
+        except OSError:
+            shutil.copyfile(blob, dest)
+        return dest
+
+
+class UploadRequest(Request):
+    """Request whose file uploads are spooled into a BlobStore while they are parsed."""
+
+    blob_store: Optional[BlobStore] = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.blob_store is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        spool = self.blob_store.spool(MAX_FILE_MB * 2**20)
+        self.spools.append(spool)
+        return spool
+
+    @property
+    def spools(self) -> List[HashingSpool]:
+        if '_spools' not in self.__dict__:
+            self.__dict__['_spools'] = []
+        return self.__dict__['_spools']
+
+    def discard_spools(self):
+        """Remove temp files of uploads that were not committed (rejected or failed requests)."""
+        for spool in self.spools:
+            spool.discard()